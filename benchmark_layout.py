@@ -0,0 +1,113 @@
+# Micro-benchmark for layout analysis on large synthetic pages
+#
+# Usage: python3 benchmark_layout.py [-r ROWS] [-c COLUMNS] [-n REPEAT]
+
+import argparse
+import random
+import timeit
+import tracemalloc
+
+from text_objects import Rectangle, Word, Line, Column
+from text_objects import group_lines, get_columns
+
+
+# make a page of rows x columns words with a little vertical jitter
+# the way OCR output of a table looks
+def synthetic_page(rows, columns, seed=0):
+    generator = random.Random(seed)
+    words = []
+    for row in range(rows):
+        y1 = 20 + row * 12
+        for column in range(columns):
+            x1 = 30 + column * 80 + generator.uniform(-3, 3)
+            jitter = generator.uniform(-2, 2)
+            words.append(Word("w{}_{}".format(row, column),
+                              Rectangle([x1, y1 + jitter, x1 + 60, y1 + 9 + jitter])))
+    generator.shuffle(words)
+    return words
+
+
+# previous quadratic grouping kept as a baseline
+def quadratic_lines(words, margin=5):
+    lines = []
+    for word in words:
+        bbox = word.box
+        added = False
+        for line in lines:
+            if (line.box.y1 - margin < bbox.y1 < line.box.y1 + margin) and (line.box.y2 - margin < bbox.y2 < line.box.y2 + margin):
+                line.add_word(word)
+                added = True
+        if not added:
+            lines.append(Line(word))
+    return lines
+
+
+# previous linear scan over columns kept as a baseline
+def quadratic_columns(lines, margin=20):
+    columns = []
+    for line in lines:
+        for word in line:
+            added = False
+            for column in columns:
+                if column.box.x1 - margin < word.box.x1 < column.box.x1 + margin \
+                        or column.box.x2 - margin < word.box.x2 < column.box.x2 + margin \
+                        or column.box.x1 + margin < word.box.x1 and word.box.x2 < column.box.x2:
+                    column.words.append(word)
+                    added = True
+            if not added:
+                columns.append(Column(word))
+    return columns
+
+
+def copy_words(words):
+    return [Word(word.value, word.box.copy()) for word in words]
+
+
+# memory held by the lines of a page, in KiB
+def page_memory(rows, columns):
+    tracemalloc.start()
+    lines = group_lines(synthetic_page(rows, columns))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / 1024
+
+
+def bench(name, func, words, repeat):
+    best = min(timeit.repeat(lambda: func(copy_words(words)),
+                             number=1, repeat=repeat))
+    print("{:<12} {:>8} words {:>10.2f} ms".format(name, len(words), best * 1000))
+
+
+def make_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Time layout analysis on synthetic pages")
+    parser.add_argument("-r", "--rows", help="rows of the largest page",
+                        type=int, default=400)
+    parser.add_argument("-c", "--columns", help="columns of each page",
+                        type=int, default=6)
+    parser.add_argument("-n", "--repeat", help="repetitions per measurement",
+                        type=int, default=3)
+    return parser
+
+
+if __name__ == "__main__":
+    args = make_argument_parser().parse_args()
+    for rows in (args.rows // 8, args.rows // 4, args.rows // 2, args.rows):
+        words = synthetic_page(rows, args.columns)
+
+        # every word must end up in exactly one line
+        lines = group_lines(copy_words(words))
+        assert sum(len(line.words) for line in lines) == len(words)
+
+        bench("quadratic", quadratic_lines, words, args.repeat)
+        bench("group_lines", group_lines, words, args.repeat)
+
+        # every word must end up in exactly one column
+        columns = get_columns(lines)
+        assert sum(len(column.words) for column in columns) == len(words)
+
+        bench("scan columns", lambda x: quadratic_columns(group_lines(x)), words, args.repeat)
+        bench("get_columns", lambda x: get_columns(group_lines(x)), words, args.repeat)
+
+        print("{:<12} {:>8} words {:>10.1f} KiB".format(
+            "page memory", len(words), page_memory(rows, args.columns)))
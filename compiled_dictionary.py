@@ -0,0 +1,352 @@
+# Compile spelling and segmentation data into a binary file that can be
+# memory mapped and shared read-only between worker processes
+#
+# Layout of the file:
+#   magic, header length, json header naming each section
+#   sections of native uint32 ('I') or float64 ('d') arrays and utf-8 blobs
+#
+# Strings of a table are stored back to back in a blob with an offsets array,
+# and found through an open addressing hash table of slots keyed by crc32
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+
+MAGIC = b'BYOBDICT'
+VERSION = 1
+ALIGNMENT = 8
+
+# cache of opened files so every module shares one mapping per process
+_OPENED = {}
+
+
+def compiled_path(dictionary_path):
+    '''
+    Returns path of the compiled file for a dictionary text file
+    '''
+    return os.path.splitext(dictionary_path)[0] + '.bin'
+
+
+def source_digest(path):
+    '''
+    Returns sha256 of the content of a file
+    '''
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def find_compiled(dictionary_path):
+    '''
+    Returns path of an up to date compiled dictionary or None
+    A compiled file is up to date if it was built from a dictionary of
+    the same size and content, modification times are not trusted
+    '''
+    path = compiled_path(dictionary_path)
+    if not os.path.isfile(path):
+        return None
+    if not os.path.isfile(dictionary_path):
+        return path
+    try:
+        meta = read_header(path)['meta']
+    except (OSError, ValueError):
+        return None
+    if meta.get('source_size') != os.path.getsize(dictionary_path) or \
+            meta.get('source_sha256') != source_digest(dictionary_path):
+        return None
+    return path
+
+
+def _slot_count(n):
+    size = 1
+    while size < 2 * n:
+        size *= 2
+    return size
+
+
+def _encode_table(keys):
+    '''
+    Returns blob, offsets and hash slots for a list of unique strings
+    '''
+    encoded = [key.encode('utf-8') for key in keys]
+    offsets = array('I', [0])
+    for key in encoded:
+        offsets.append(offsets[-1] + len(key))
+    mask = _slot_count(len(encoded)) - 1
+    slots = array('I', [0]) * (mask + 1)
+    for i, key in enumerate(encoded):
+        slot = zlib.crc32(key) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = i + 1
+    return b''.join(encoded), offsets, slots
+
+
+class Writer:
+    '''
+    Sections and meta data of a compiled file, written by write and read
+    back by CompiledFile with the same magic and version
+    '''
+
+    def __init__(self, magic=MAGIC, version=VERSION):
+        self.magic = magic
+        self.version = version
+        self.sections = {}
+        self.meta = {}
+
+    # add a string table with optional float values
+    def add_table(self, name, keys, values=None):
+        blob, offsets, slots = _encode_table(keys)
+        self.sections[name + '.blob'] = ('B', blob)
+        self.sections[name + '.offsets'] = ('I', offsets)
+        self.sections[name + '.slots'] = ('I', slots)
+        if values is not None:
+            self.sections[name + '.values'] = ('d', array('d', values))
+
+    # add a table mapping keys to lists of row numbers of another table
+    def add_index(self, name, index, rows):
+        keys = list(index)
+        starts = array('I', [0])
+        postings = array('I')
+        for key in keys:
+            postings.extend(rows[word] for word in index[key])
+            starts.append(len(postings))
+        self.add_table(name, keys)
+        self.sections[name + '.starts'] = ('I', starts)
+        self.sections[name + '.postings'] = ('I', postings)
+
+    def write(self, path):
+        header = {'version': self.version, 'byteorder': sys.byteorder,
+                  'meta': self.meta, 'sections': {}}
+        chunks = []
+        offset = 0
+        for name, (fmt, data) in self.sections.items():
+            raw = data if isinstance(data, bytes) else data.tobytes()
+            header['sections'][name] = {
+                'format': fmt, 'offset': offset, 'length': len(raw)}
+            chunks.append(raw + b'\0' * (-len(raw) % ALIGNMENT))
+            offset += len(chunks[-1])
+
+        encoded = json.dumps(header).encode('utf-8')
+        start = len(self.magic) + 4 + len(encoded)
+        padding = -start % ALIGNMENT
+        with open(path, 'wb') as f:
+            f.write(self.magic)
+            f.write(struct.pack('<I', len(encoded) + padding))
+            f.write(encoded + b' ' * padding)
+            for chunk in chunks:
+                f.write(chunk)
+
+
+class CompiledTable(Mapping):
+    '''
+    Read-only string to float mapping backed by sections of a compiled file
+    '''
+
+    def __init__(self, compiled, name):
+        self.blob = compiled.section(name + '.blob')
+        self.offsets = compiled.section(name + '.offsets')
+        self.slots = compiled.section(name + '.slots')
+        self.values = compiled.section(name + '.values')
+        self.mask = len(self.slots) - 1
+
+    # row number of key or -1 if absent
+    def find(self, key):
+        encoded = key.encode('utf-8')
+        slot = zlib.crc32(encoded) & self.mask
+        row = self.slots[slot]
+        while row:
+            start, end = self.offsets[row - 1], self.offsets[row]
+            if end - start == len(encoded) and self.blob[start:end] == encoded:
+                return row - 1
+            slot = (slot + 1) & self.mask
+            row = self.slots[slot]
+        return -1
+
+    def key(self, row):
+        return bytes(self.blob[self.offsets[row]:self.offsets[row + 1]]).decode('utf-8')
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self.find(key) >= 0
+
+    def __getitem__(self, key):
+        row = self.find(key) if isinstance(key, str) else -1
+        if row < 0:
+            raise KeyError(key)
+        return self.values[row]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return (self.key(row) for row in range(len(self)))
+
+
+class CompiledIndex:
+    '''
+    Read-only mapping from strings to lists of keys of another table
+    '''
+
+    def __init__(self, compiled, name, table):
+        self.keys = CompiledTable(compiled, name)
+        self.starts = compiled.section(name + '.starts')
+        self.postings = compiled.section(name + '.postings')
+        self.table = table
+
+    def get(self, key, default=None):
+        row = self.keys.find(key)
+        if row < 0:
+            return default
+        postings = self.postings[self.starts[row]:self.starts[row + 1]]
+        return [self.table.key(i) for i in postings]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def _parse_header(data, path, magic=MAGIC, version=VERSION):
+    '''
+    Returns json header at the start of data and offset of the sections
+    '''
+    if bytes(data[:len(magic)]) != magic:
+        raise ValueError("{} is not a {} file".format(path, magic.decode('ascii')))
+    start = len(magic) + 4
+    if len(data) < start:
+        raise ValueError("{} is truncated".format(path))
+    length, = struct.unpack('<I', data[len(magic):start])
+    header = json.loads(bytes(data[start:start + length]).decode('utf-8'))
+    if header['version'] != version or header['byteorder'] != sys.byteorder:
+        raise ValueError("{} was compiled for another version or platform, rebuild it".format(path))
+    return header, start + length
+
+
+def read_header(path, magic=MAGIC, version=VERSION):
+    '''
+    Returns json header of a compiled file without mapping its sections
+    '''
+    with open(path, 'rb') as f:
+        data = f.read(len(magic) + 4)
+        if len(data) == len(magic) + 4 and data[:len(magic)] == magic:
+            length, = struct.unpack('<I', data[len(magic):])
+            data += f.read(length)
+    return _parse_header(data, path, magic, version)[0]
+
+
+class CompiledFile:
+    '''
+    Memory mapped file of sections written by Writer
+    '''
+
+    def __init__(self, path, magic=MAGIC, version=VERSION):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        header, start = _parse_header(view, path, magic, version)
+        self.view = view[start:]
+        self.header = header
+        self.meta = header['meta']
+
+    # typed view on a section, None if the section is missing
+    def section(self, name):
+        if name not in self.header['sections']:
+            return None
+        section = self.header['sections'][name]
+        data = self.view[section['offset']:section['offset'] + section['length']]
+        return data.cast(section['format'])
+
+
+class CompiledDictionary(CompiledFile):
+    '''
+    Memory mapped compiled dictionary
+
+    words: word counts of the spelling dictionary
+    deletes: symmetric delete index over words
+    unigrams, bigrams: wordsegment counts or None if not compiled in
+    '''
+
+    def __init__(self, path):
+        CompiledFile.__init__(self, path)
+        self.words = CompiledTable(self, 'words')
+        self.deletes = CompiledIndex(self, 'deletes', self.words)
+        self.total = self.meta['total']
+        if 'unigrams.blob' in self.header['sections']:
+            self.unigrams = CompiledTable(self, 'unigrams')
+            self.bigrams = CompiledTable(self, 'bigrams')
+        else:
+            self.unigrams = None
+            self.bigrams = None
+
+
+def open_compiled(path):
+    '''
+    Returns the compiled dictionary at path, mapping each file once per process
+    '''
+    path = os.path.abspath(path)
+    if path not in _OPENED:
+        _OPENED[path] = CompiledDictionary(path)
+    return _OPENED[path]
+
+
+def build(dictionary_path, output_path, segmentation=True):
+    '''
+    Compile word counts, delete index and optionally wordsegment counts
+    '''
+    # imported here, spell_correct imports this module to read compiled files
+    import spell_correct
+    with open(dictionary_path) as f:
+        counts = Counter(spell_correct.words(f.read()))
+    words = list(counts)
+    rows = {word: i for i, word in enumerate(words)}
+
+    writer = Writer()
+    writer.meta['total'] = sum(counts.values())
+    writer.meta['source_size'] = os.path.getsize(dictionary_path)
+    writer.meta['source_sha256'] = source_digest(dictionary_path)
+    writer.add_table('words', words, [counts[word] for word in words])
+    writer.add_index('deletes', spell_correct.build_index(words), rows)
+
+    if segmentation:
+        import wordsegment
+        segmenter = wordsegment.Segmenter
+        for name, filename in (('unigrams', segmenter.UNIGRAMS_FILENAME),
+                               ('bigrams', segmenter.BIGRAMS_FILENAME)):
+            table = segmenter.parse(filename)
+            writer.add_table(name, list(table), list(table.values()))
+        writer.meta['segment_total'] = segmenter.TOTAL
+        writer.meta['segment_limit'] = segmenter.LIMIT
+
+    writer.write(output_path)
+    return output_path
+
+
+def make_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Compile the spelling dictionary and segmentation data into a memory mappable file")
+    parser.add_argument("-d", "--dictionary", help="dictionary text file, default is dictionary.txt",
+                        required=False, default=None)
+    parser.add_argument("-o", "--output", help="compiled file, default is dictionary.bin next to the dictionary",
+                        required=False, default=None)
+    parser.add_argument("--no-segmentation", help="do not compile wordsegment data",
+                        action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    import spell_correct
+    args = make_argument_parser().parse_args()
+    dictionary_path = args.dictionary or spell_correct.DICTIONARY_PATH
+    output_path = args.output or compiled_path(dictionary_path)
+    build(dictionary_path, output_path, not args.no_segmentation)
+    print("Compiled {} to {}".format(dictionary_path, output_path))
@@ -1,42 +1,20 @@
-from tkinter import *
-from tkinter import filedialog
 import argparse
+import importlib.util
 import sys
 import os
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import cpu_count
 from os.path import join
-from generate_readables import generate_readables
-from generate_csv import process_csv
-from generate_doc import process_doc
+from generate_readables import generate_readables, OCR_CACHE_MB
+from generate_csv import csv_from_pages
+from generate_doc import doc_from_pages
 from functools import partial
-
-
-# list of parsing modes
-# line margin vertical margin for getting lines
-# merge margin horizontal margin for clubbing words
-# adj margin for vertical distance between lines for marking
-# large cutoff ratio of line with page to call as para
-# para margin to club lines into paragraphs
-# column margin horizontal margin between columns
-parsing_modes = {
-    'standard': {
-        'line_margin': 10,
-        'merge_margin': 15,
-        'adj_margin': 15,
-        'large_cutoff': 0.6,
-        'para_margin': 20,
-        'column_margin': 20
-    },
-
-    'simplespaced': {
-        'line_margin': 10,
-        'merge_margin': 30,
-        'adj_margin': 15,
-        'large_cutoff': 0.6,
-        'para_margin': 20,
-        'column_margin': 20
-    }
-}
+import spell_cache
+import spell_correct
+import spell_fixer
+import word_cache
+from parsing_modes import parsing_modes
 
 
 def make_argument_parser():
@@ -46,6 +24,34 @@ def make_argument_parser():
                         required=False, default="standard")
     parser.add_argument(
         "-p", "--path", help="give input path for file or directory", required=True)
+    parser.add_argument("--cache-size", help="number of spelling results kept in memory, 0 disables caching",
+                        required=False, type=int, default=spell_cache.DEFAULT_SIZE)
+    parser.add_argument("--cache-file", help="file to load spelling cache from and save it to after the run",
+                        required=False, default=None)
+    parser.add_argument("--dictionary", help="word list used for spelling correction, default is dictionary.txt",
+                        required=False, default=None)
+    parser.add_argument("--patterns", help="json file of the patterns that find profit and loss headers and footers",
+                        required=False, default=None)
+    parser.add_argument("--hocr", help="build layout from tesseract hocr directly, skipping the ocr pdf and xml",
+                        action="store_true")
+    parser.add_argument("--pipeline", help="render and ocr pages in chunks of this many pages, 0 renders whole files first",
+                        required=False, type=int, default=0)
+    parser.add_argument("--tesseract-api", help="keep a tesseract engine loaded in every ocr worker, needs tesserocr",
+                        action="store_true")
+    parser.add_argument("--ocr-all-pages", help="ocr every page, even pages that already have a text layer",
+                        action="store_true")
+    parser.add_argument("--triage", help="with --csv, scan pages at low resolution first and only ocr the profit and loss pages",
+                        action="store_true")
+    parser.add_argument("--numpy-preprocess", help="clean up page images with NumPy in the ocr workers instead of ImageMagick",
+                        action="store_true")
+    parser.add_argument("--stream-pages", help="pass pages from ghostscript to ocr through a pipe as raw images, not jpeg files",
+                        action="store_true")
+    parser.add_argument("--ocr-cache", help="directory to cache ocr results in by the hash of files and pages",
+                        required=False, default=None)
+    parser.add_argument("--ocr-cache-size", help="size cap of the ocr cache in megabytes, default is 1024",
+                        required=False, type=int, default=OCR_CACHE_MB)
+    parser.add_argument("-j", "--jobs", help="number of files converted in parallel, default is 1",
+                        required=False, type=int, default=1)
     action = parser.add_mutually_exclusive_group(required=True)
     action.add_argument(
         "--csv", help="store profit and loss table in csv", action="store_true")
@@ -54,6 +60,82 @@ def make_argument_parser():
     return parser
 
 
+# set up spelling dictionary and caches of this process
+def init_spelling(args):
+    # dictionary is only read once a spelling is corrected
+    if args.dictionary:
+        spell_correct.set_dictionary(args.dictionary)
+    if args.patterns:
+        spell_fixer.load_patterns(args.patterns)
+
+    # size spelling caches and warm them up from a previous run
+    spell_cache.configure(args.cache_size)
+    if args.cache_file:
+        if not spell_cache.load(args.cache_file, spell_correct.dictionary_digest()) \
+                and os.path.isfile(args.cache_file):
+            print("Spelling cache {} was saved with another dictionary, not loading it".format(
+                args.cache_file))
+
+
+# convert readable file of a pdf to csv or doc, returns output path
+def convert_readable(working_dir, file_name, args):
+    name = file_name.split(".")[0]
+    if args.hocr:
+        input_path = join(working_dir, "hocr", name)
+        kind = "hocr"
+    else:
+        input_path = join(working_dir, "xml", name + ".xml")
+        kind = "xml"
+    # words and boxes are read once per readable file and reused by later
+    # runs, so only layout analysis runs again under another parsing mode
+    pages = word_cache.cached_words(input_path, word_cache.words_path(working_dir, name, kind))
+    if args.doc:
+        print("Converting {} to Doc".format(name))
+        output_path = join(working_dir, "doc", name + ".doc")
+        doc_from_pages(pages, output_path, parsing_modes[args.mode])
+    else:
+        print("Converting {} to CSV".format(name))
+        output_path = join(working_dir, "csv", name + ".csv")
+        csv_from_pages(pages, output_path, parsing_modes[args.mode])
+    return output_path
+
+
+# make readable files of one pdf and convert it, run in a batch worker
+# returns output path and, when the spelling cache is saved, the entries
+# added to the worker's spelling caches while converting this file
+def convert_file(working_dir, file_name, args, threads):
+    known = spell_cache.keys() if args.cache_file else None
+    # generate_readables drops files it could not convert from the list
+    files = [file_name]
+    generate_readables(working_dir, files, args.hocr, threads, args.pipeline, args.tesseract_api,
+                       args.ocr_all_pages, args.triage, args.numpy_preprocess, args.stream_pages,
+                       args.ocr_cache, args.ocr_cache_size)
+    if file_name not in files:
+        raise RuntimeError("could not convert {} to a readable file".format(file_name))
+    output_path = convert_readable(working_dir, file_name, args)
+    return output_path, spell_cache.entries(known) if args.cache_file else None
+
+
+# convert files in parallel, cores are split between the files being
+# converted and the ocr pools of each file
+# yields (file name, output path, error) as files complete
+# spelling cache entries of the workers are merged into this process
+def convert_batch(working_dir, files, args):
+    jobs = min(args.jobs, len(files))
+    threads = max(1, cpu_count() // jobs)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_spelling, initargs=(args,)) as executor:
+        futures = {executor.submit(convert_file, working_dir, file_name, args, threads): file_name
+                   for file_name in files}
+        for future in as_completed(futures):
+            try:
+                output_path, entries = future.result()
+                if entries:
+                    spell_cache.merge(entries)
+                yield futures[future], output_path, None
+            except Exception as e:
+                yield futures[future], None, e
+
+
 if __name__ == "__main__":
 
     # get parsing mode
@@ -64,6 +146,18 @@ if __name__ == "__main__":
             print(" -", mode_names)
         exit()
 
+    if args.triage and not args.csv:
+        print("Triage only finds profit and loss pages, use it with --csv")
+        exit()
+
+    if args.jobs < 1:
+        print("The number of jobs must be at least 1")
+        exit()
+
+    if args.numpy_preprocess and importlib.util.find_spec("numpy") is None:
+        print("--numpy-preprocess needs numpy, install it with: python3 -m pip install numpy")
+        exit(1)
+
     # check given path and set working directory for making readable files
     input_path = args.path
     if os.path.exists(input_path) and os.path.isdir(input_path):
@@ -82,25 +176,45 @@ if __name__ == "__main__":
     for file in files:
         print(file)
 
+    init_spelling(args)
+
+    if args.jobs > 1 and len(files) > 1:
+        # spelling caches live in the workers, their entries come back with
+        # the results to be saved here
+        failed = []
+        for done, (file_name, output_path, error) in enumerate(convert_batch(working_dir, files, args), 1):
+            if error:
+                failed.append(file_name)
+                print("FAILED ({}/{}): {}: {}".format(done, len(files), file_name, error))
+            else:
+                print("Converted ({}/{}): {} to {}".format(done, len(files), file_name, output_path))
+
+        if args.cache_file:
+            spell_cache.save(args.cache_file, spell_correct.dictionary_digest())
+
+        if failed:
+            print("Could not convert the following files:")
+            for file_name in failed:
+                print(file_name)
+            sys.exit(1)
+        print("SUCCESS: Files converted successfully")
+        sys.exit()
+
     # generate readable files from pdfs i.e. ocr pdf and xml
-    generate_readables(working_dir, files)
+    generate_readables(working_dir, files, args.hocr,
+                       pipeline_pages=args.pipeline, ocr_api=args.tesseract_api,
+                       ocr_all_pages=args.ocr_all_pages, triage=args.triage,
+                       numpy_preprocess=args.numpy_preprocess, stream_pages=args.stream_pages,
+                       ocr_cache_dir=args.ocr_cache, ocr_cache_mb=args.ocr_cache_size)
 
     # call function to generate csv or doc
     for file_name in files:
-        name = file_name.split(".")[0]
-        if args.doc:
-            print("Converting {} to Doc".format(name))
-            process_doc(
-                join(working_dir, "xml", name + ".xml"),
-                join(working_dir, "doc", name + ".doc"),
-                parsing_modes[args.mode],
-            )
-        else:
-            print("Converting {} to CSV".format(name))
-            process_csv(
-                join(working_dir, "xml", name + ".xml"),
-                join(working_dir, "csv", name + ".csv"),
-                parsing_modes[args.mode],
-            )
+        convert_readable(working_dir, file_name, args)
+
+    # persist spelling cache for the next run
+    print("Spelling cache usage:")
+    print(spell_cache.stats())
+    if args.cache_file:
+        spell_cache.save(args.cache_file, spell_correct.dictionary_digest())
 
     print("SUCCESS: Files converted successfully")
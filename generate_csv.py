@@ -6,8 +6,9 @@ import sys
 
 from docx import Document
 from text_objects import Rectangle, Word, Line, LineType, Column
-from text_objects import get_lines, get_columns
+from text_objects import get_columns
 from text_objects import centre_aligned, merge_words, check_fix_spellings
+from text_objects import read_pages, group_lines, vertical_key, horizontal_key
 
 triage_data = {
     "interest receivable and similar income": "Interest Receivable",
@@ -51,6 +52,22 @@ triage_data = {
     "profit after taxation being profit for the financial year": "Profit for the financial year"
 }
 
+
+# map every substring of the lowercased keys of triage_data to the value of
+# the first key containing it, so a word is mapped with one lookup
+# the empty string is in every key and maps to the first value
+def build_triage_index(triage_data):
+    index = {}
+    for key, value in triage_data.items():
+        key = key.lower()
+        for start in range(len(key) + 1):
+            for end in range(start, len(key) + 1):
+                index.setdefault(key[start:end], value)
+    return index
+
+
+triage_index = build_triage_index(triage_data)
+
 # function to check for table headings
 # table headings takes json file with example headings to compare
 
@@ -110,16 +127,18 @@ def filter_and_mark(lines, page_box, page_width, margin=20, cutoff=0.6):
             line.type = LineType.TABLE
 
 
-def process_csv(input_path, output_path, parse_mode):
-
-    xml_file = tree.parse(input_path).getroot()
-    for page in xml_file.getchildren():
-        page_box = Rectangle(list(map(float, page.attrib["bbox"].split(","))))
+# rows of the profit and loss table of pages of (page box, words), the last
+# page with such a table wins, None if there is none
+# word boxes are merged in place, pass copies to extract rows more than once
+def extract_rows(pages, parse_mode):
+    rows = None
+    for page_box, words in pages:
         page_mid = (page_box.x1 + page_box.x2)/2
         page_width = page_box.x2 - page_box.x1
-        lines = get_lines(page, parse_mode["line_margin"])
+
+        lines = group_lines(words, parse_mode["line_margin"])
         lines = merge_words(lines, parse_mode["merge_margin"])
-        lines.sort(reverse=True)
+        lines.sort(key=vertical_key, reverse=True)
 
         # filter and mark names with appropriate types
         filter_and_mark(lines, page_box, page_width,
@@ -139,31 +158,38 @@ def process_csv(input_path, output_path, parse_mode):
 
             # write to csv
             columns = get_columns(table_lines, parse_mode["column_margin"])
-            columns.sort()
-            for i, column in enumerate(columns):
-                for word in column.words:
-                    word.col_num = i
             max_col = len(columns)
 
-            # make lower
+            # make lower and perform triaging, a word contained in a key of
+            # triage_data is replaced by the value of the first such key
             for line in table_lines:
                 for word in line:
-                    word.value = word.value.lower()
+                    value = word.value.lower()
+                    word.value = triage_index.get(value, value)
 
-            # perform triaging using json file
+            rows = []
             for line in table_lines:
-                for word in line:
-                    for key in triage_data.keys():
-                        if word.value in key.lower():
-                            word.value = triage_data[key]
-                            break
-
-            with open(output_path, "w") as csvfile:
-                csvwriter = csv.writer(csvfile, delimiter=',',
-                                       quotechar='"', quoting=csv.QUOTE_ALL)
-                for line in table_lines:
-                    line.words.sort()
-                    csv_line = [None]*(max_col)
-                    for word in line.words:
-                        csv_line[word.col_num] = word.value
-                    csvwriter.writerow(csv_line)
+                line.words.sort(key=horizontal_key)
+                csv_line = [None]*(max_col)
+                for word in line.words:
+                    csv_line[word.col_num] = word.value
+                rows.append(csv_line)
+    return rows
+
+
+def write_csv(rows, output_path):
+    with open(output_path, "w") as csvfile:
+        csvwriter = csv.writer(csvfile, delimiter=',',
+                               quotechar='"', quoting=csv.QUOTE_ALL)
+        csvwriter.writerows(rows)
+
+
+def process_csv(input_path, output_path, parse_mode):
+    csv_from_pages(read_pages(input_path), output_path, parse_mode)
+
+
+# write a csv from pages of page box and words
+def csv_from_pages(pages, output_path, parse_mode):
+    rows = extract_rows(pages, parse_mode)
+    if rows is not None:
+        write_csv(rows, output_path)
@@ -10,8 +10,9 @@ from itertools import groupby
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from docx.shared import Pt, Inches
 from text_objects import Rectangle, Word, Line, LineType, Column
-from text_objects import get_lines, get_columns, get_paragraphs
+from text_objects import get_columns, get_paragraphs
 from text_objects import centre_aligned, merge_words, check_fix_spellings
+from text_objects import read_pages, group_lines, vertical_key
 
 
 # print centre aligned text as bold and centred in doc
@@ -99,15 +100,19 @@ def filter_and_mark(lines, page_box, page_width, margin=15, cutoff=0.6):
 
 
 def process_doc(input_path, output_path, parse_mode):
+    doc_from_pages(read_pages(input_path), output_path, parse_mode)
+
+
+# write a doc from pages of page box and words
+def doc_from_pages(pages, output_path, parse_mode):
     document = Document()
-    xml_file = tree.parse(input_path).getroot()
-    for page in xml_file.getchildren():
-        page_box = Rectangle(list(map(float, page.attrib["bbox"].split(","))))
+    for page_box, words in pages:
         page_mid = (page_box.x1 + page_box.x2)/2
         page_width = page_box.x2 - page_box.x1
-        lines = get_lines(page, parse_mode['line_margin'])
+
+        lines = group_lines(words, parse_mode['line_margin'])
         lines = merge_words(lines, parse_mode['merge_margin'])
-        lines.sort(reverse=True)
+        lines.sort(key=vertical_key, reverse=True)
 
         # filter and mark names with appropriate types
         filter_and_mark(lines, page_box, page_width,
@@ -132,10 +137,6 @@ def process_doc(input_path, output_path, parse_mode):
                                      parse_mode["large_cutoff"], parse_mode["para_margin"])
             elif k == LineType.TABLE:
                 columns = get_columns(line_group)
-                columns.sort()
-                for i, column in enumerate(columns):
-                    for word in column.words:
-                        word.col_num = i
                 max_col = len(columns)
 
                 # don't make tables for single columns
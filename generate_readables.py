@@ -1,16 +1,84 @@
+import io
 import os
+import re
+import shutil
+import traceback
+import xml.etree.ElementTree as tree
 
+from multiprocessing import Pool, cpu_count
 from os.path import join
+from pdfminer.high_level import extract_text_to_fp
+from pdfminer.layout import LAParams
+from pdfminer.pdfpage import PDFPage
 from pypdfocr.pypdfocr import PyPDFOCR
+from pypdfocr.pypdfocr_cache import file_digest
+from pypdfocr.pypdfocr_interrupts import init_worker
+from spell_fixer import PATTERN_SETS, classify_lines
+from text_objects import get_hocr_words, group_lines
 
+# number of pages extracted by one worker task
+XML_CHUNK_PAGES = 8
 
-def generate_readables(working_dir, files):
+# id attribute of the page elements of pdfminer xml
+PAGE_ID = re.compile(r'<page id="(\d+)"')
+
+# letters and digits a page needs in its text layer to be used without ocr
+TEXT_MIN_CHARS = 50
+
+# resolution of the quick scan that picks pages for ocr in triage mode
+TRIAGE_DPI = 100
+
+# pattern lists of the lines that mark a page worth ocr in triage mode
+TRIAGE_PATTERNS = ["pl_lines", "header_endings"]
+
+# default size cap of the ocr cache in megabytes
+OCR_CACHE_MB = 1024
+
+
+def generate_readables(working_dir, files, hocr_only=False, threads=None, pipeline_pages=0, ocr_api=False,
+                       ocr_all_pages=False, triage=False, numpy_preprocess=False, stream_pages=False,
+                       ocr_cache_dir=None, ocr_cache_mb=OCR_CACHE_MB):
     '''
     convert all pdfs in dir_path in 3 formats,
     1. text readable pdfs, stored in ocr/
     2. xml from pdf, stored in xml/
 
-    Requires pdf2txt.py
+    With hocr_only the tesseract hocr of every page is stored in
+    hocr/<name>/ instead, skipping the ocr pdf and xml
+
+    Files that could not be converted are removed from files
+
+    threads limits the processes used for the pages of a file, so several
+    files can be converted side by side without oversubscribing cores
+
+    With pipeline_pages pages are rendered that many at a time and OCR'ed
+    while the next pages render, instead of rendering the whole file first
+
+    With ocr_api every ocr worker keeps a tesseract engine loaded through
+    tesserocr instead of running the tesseract binary for each page
+
+    Pages of a pdf that already have a usable text layer are not ocr'ed,
+    unless ocr_all_pages is set
+
+    With triage pages are first scanned at a low resolution and only pages
+    that look like a profit and loss statement are ocr'ed, all pages if none do
+
+    With numpy_preprocess pages are cleaned up for ocr on NumPy arrays in the
+    ocr workers instead of by running ImageMagick for each page
+
+    With stream_pages ghostscript writes raw pages to a pipe that the ocr
+    workers read, instead of jpeg files
+
+    With ocr_cache_dir the hocr of every file and page is cached there by the
+    hash of its content and the ocr settings, so renamed files and pages
+    repeated across files are not ocr'ed again. A file converted before with
+    the same settings skips the text probe and triage as well. Least recently
+    used entries are evicted above ocr_cache_mb megabytes
+
+    Outputs record the hash of the pdf they were made from and are made again
+    when a different pdf has the same name
+
+    Requires pdfminer
     '''
 
     ocr_dir = join(working_dir, "ocr")
@@ -18,39 +86,83 @@ def generate_readables(working_dir, files):
     doc_dir = join(working_dir, "doc")
     xml_dir = join(working_dir, "xml")
     converter = PyPDFOCR()
+    converter.config['tesseract'] = {'backend': 'api' if ocr_api else 'cli'}
+    converter.config['preprocess'] = {'engine': 'numpy' if numpy_preprocess else 'convert'}
+    if threads:
+        converter.config['tesseract']['threads'] = threads
+        converter.config['preprocess']['threads'] = threads
+    if pipeline_pages:
+        converter.config['pipeline'] = {'chunk_pages': pipeline_pages}
+    if stream_pages:
+        converter.config['ghostscript'] = {'stream': True}
+    if not ocr_all_pages:
+        converter.config['text_probe'] = {'min_chars': TEXT_MIN_CHARS}
+    page_filter = None
+    if triage:
+        # the patterns pick the pages, so a cached conversion is only
+        # reused while they are unchanged
+        converter.config['triage'] = {'dpi': TRIAGE_DPI,
+                                      'patterns': {name: PATTERN_SETS[name] for name in TRIAGE_PATTERNS}}
+        page_filter = statement_pages
+    if ocr_cache_dir:
+        converter.config['cache'] = {'dir': ocr_cache_dir, 'max_bytes': ocr_cache_mb << 20}
+
+    if hocr_only:
+        generate_hocr(working_dir, files, converter, page_filter)
+        return
 
     # generate readable pdf using ocr library
     if not os.path.isdir(ocr_dir):
         print("Creating OCR directory")
-        os.mkdir(ocr_dir)
+        os.makedirs(ocr_dir, exist_ok=True)
     if not os.path.isdir(xml_dir):
         print("Creating XML directory")
-        os.mkdir(xml_dir)
+        os.makedirs(xml_dir, exist_ok=True)
     if not os.path.isdir(doc_dir):
         print("Creating DOC directory")
-        os.mkdir(doc_dir)
-
-    for i, file_name in enumerate(files):
-        output_file = file_name.split(".")[0] + "_ocr.pdf"
-        output_path = join(ocr_dir, output_file)
+        os.makedirs(doc_dir, exist_ok=True)
 
-        # do not convert if file of the same name is already converted
-        if output_file not in os.listdir(ocr_dir):
-            print("Converting {} to ocr pdf".format(file_name))
+    # ocr workers are started for the first file that needs them and
+    # reused for the rest
+    failed = []
+    try:
+        for file_name in files:
+            output_file = file_name.split(".")[0] + "_ocr.pdf"
+            output_path = join(ocr_dir, output_file)
             file_path = join(working_dir, file_name)
-            # print error message and ignore file if cannot convert ocr
-            try:
-                converter.go(file_path)
-            except:
-                print("Could not convert {} to OCR pdf".format(file_name))
-                del files[i]
-            os.rename(join(working_dir, output_file), output_path)
-        else:
-            print("OCR version for {} exists".format(file_name))
+            digest = file_digest(file_path)
 
-    # generate parsable xml files from ocr pdf
+            # a file of the same name made from a different pdf is stale
+            if output_file in os.listdir(ocr_dir) and not is_current(output_path, digest):
+                print("OCR version for {} is from a different file".format(file_name))
+                os.remove(output_path)
+                remove_file(join(xml_dir, file_name.split(".")[0] + ".xml"))
 
+            # do not convert if file of the same name is already converted
+            if output_file not in os.listdir(ocr_dir):
+                print("Converting {} to ocr pdf".format(file_name))
+                converter.start()
+                # print error message and ignore file if cannot convert ocr
+                try:
+                    converter.go(file_path, page_filter=page_filter)
+                except:
+                    print("Could not convert {} to OCR pdf".format(file_name))
+                    failed.append(file_name)
+                    continue
+                os.rename(join(working_dir, output_file), output_path)
+                record_source(output_path, digest)
+            else:
+                print("OCR version for {} exists".format(file_name))
+    finally:
+        converter.close()
+    for file_name in failed:
+        files.remove(file_name)
+    if converter.pages_seen:
+        print("Skipped OCR on {} of {} pages that have a text layer".format(
+            converter.pages_skipped, converter.pages_seen))
 
+    # generate parsable xml files from ocr pdf
+    pending = []
     for file_name in files:
         input_path = join(ocr_dir, file_name.split(".")[0] + "_ocr.pdf")
         output_file = file_name.split(".")[0] + ".xml"
@@ -59,6 +171,184 @@ def generate_readables(working_dir, files):
         # do not convert if file of the same name is already converted
         if output_file not in os.listdir(xml_dir):
             print("Converting {} to XML file".format(file_name))
-            os.system('pdf2txt.py -t xml ' + input_path + ' > ' + output_path)
+            pending.append((file_name, input_path, output_path))
         else:
             print("XML version for {} exists".format(file_name))
+
+    # files without xml are left out of the rest of the run
+    for file_name, error in generate_xml(pending, threads):
+        print("Could not convert {} to XML file: {}".format(file_name, error))
+        files.remove(file_name)
+
+
+# file recording the hash of the pdf an output was made from
+def source_record(output_path):
+    if os.path.isdir(output_path):
+        return join(output_path, "source.sha256")
+    return output_path + ".sha256"
+
+
+def record_source(output_path, digest):
+    with open(source_record(output_path), "w") as f:
+        f.write(digest)
+
+
+# outputs made before hashes were recorded are trusted
+def is_current(output_path, digest):
+    try:
+        with open(source_record(output_path)) as f:
+            return f.read().strip() == digest
+    except FileNotFoundError:
+        return True
+
+
+def remove_file(path):
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def statement_pages(scanned):
+    '''
+    pick pages with a line naming a profit and loss statement or ending
+    its header, from a dict of page number to hocr of a quick scan
+    '''
+    pages = []
+    for page_num, hocr in scanned.items():
+        try:
+            root = tree.fromstring(hocr)
+        except tree.ParseError:
+            continue
+        for element in root.iter():
+            if element.attrib.get("class") == "ocr_page":
+                page_box, words = get_hocr_words(element)
+                if any(classify_lines(group_lines(words), TRIAGE_PATTERNS)):
+                    pages.append(page_num)
+                break
+    return pages
+
+
+def extract_xml_pages(task):
+    '''
+    run pdfminer layout analysis on a range of pages of a pdf
+    returns the <page> elements as text, or None and the error
+    pdfminer numbers the pages of every range from 1, they are renumbered
+    to their place in the pdf as pdf2txt numbers them
+    '''
+    input_path, first, last = task
+    try:
+        output = io.BytesIO()
+        with open(input_path, "rb") as f:
+            extract_text_to_fp(f, output, output_type="xml", codec="utf-8",
+                               laparams=LAParams(), page_numbers=set(range(first, last)))
+        text = output.getvalue().decode("utf-8")
+        start = text.index("<pages>") + len("<pages>")
+        end = text.rindex("</pages>")
+        text = PAGE_ID.sub(lambda m: '<page id="{}"'.format(int(m.group(1)) + first),
+                           text[start:end])
+        return text.strip("\n"), None
+    except Exception:
+        return None, traceback.format_exc().strip().splitlines()[-1]
+
+
+def count_pages(input_path):
+    with open(input_path, "rb") as f:
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+
+def generate_xml(pending, processes=None):
+    '''
+    write pdfminer xml of (file name, pdf path, xml path) triples
+    pages of all files are extracted in parallel by a pool of processes
+    yields (file name, error) of files that could not be converted
+    '''
+    tasks = []
+    owners = []
+    for file_name, input_path, output_path in pending:
+        try:
+            pages = count_pages(input_path)
+        except Exception as e:
+            yield file_name, e
+            continue
+        for first in range(0, pages, XML_CHUNK_PAGES):
+            tasks.append((input_path, first, min(first + XML_CHUNK_PAGES, pages)))
+            owners.append((file_name, output_path))
+    if not tasks:
+        return
+
+    pool = Pool(processes=processes or cpu_count(), initializer=init_worker)
+    try:
+        results = pool.map(extract_xml_pages, tasks)
+        pool.close()
+    except KeyboardInterrupt:
+        print("Caught keyboard interrupt... terminating")
+        pool.terminate()
+        raise
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    # stitch pages of each file in order, files with a failed range are not written
+    chunks = {}
+    errors = {}
+    for (file_name, output_path), (text, error) in zip(owners, results):
+        chunks.setdefault((file_name, output_path), []).append(text)
+        if error and file_name not in errors:
+            errors[file_name] = error
+    for (file_name, output_path), texts in chunks.items():
+        if file_name in errors:
+            yield file_name, errors[file_name]
+            continue
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="utf-8" ?>\n<pages>\n')
+            for text in texts:
+                if text:
+                    f.write(text + "\n")
+            f.write("</pages>\n")
+
+
+def generate_hocr(working_dir, files, converter, page_filter=None):
+    '''
+    store hocr pages of all pdfs in hocr/<name>/ for building layout directly
+    files that could not be converted are removed from files
+    '''
+
+    hocr_dir = join(working_dir, "hocr")
+    if not os.path.isdir(hocr_dir):
+        print("Creating HOCR directory")
+        os.makedirs(hocr_dir, exist_ok=True)
+
+    failed = []
+    try:
+        for file_name in files:
+            page_dir = join(hocr_dir, file_name.split(".")[0])
+            file_path = join(working_dir, file_name)
+            digest = file_digest(file_path)
+
+            # pages of the same name made from a different pdf are stale
+            if os.path.isdir(page_dir) and not is_current(page_dir, digest):
+                print("HOCR version for {} is from a different file".format(file_name))
+                shutil.rmtree(page_dir)
+
+            # do not convert if pages of the same name are already stored
+            if os.path.isdir(page_dir) and os.listdir(page_dir):
+                print("HOCR version for {} exists".format(file_name))
+                continue
+
+            print("Converting {} to hocr pages".format(file_name))
+            converter.start()
+            try:
+                converter.go(file_path, hocr_dir=page_dir, overlay=False,
+                             page_filter=page_filter)
+                record_source(page_dir, digest)
+            except Exception:
+                print("Could not convert {} to hocr".format(file_name))
+                failed.append(file_name)
+                # pages written before the failure would pass for a conversion
+                if os.path.isdir(page_dir):
+                    shutil.rmtree(page_dir)
+    finally:
+        converter.close()
+    for file_name in failed:
+        files.remove(file_name)
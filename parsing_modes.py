@@ -0,0 +1,26 @@
+# list of parsing modes
+# line margin vertical margin for getting lines
+# merge margin horizontal margin for clubbing words
+# adj margin for vertical distance between lines for marking
+# large cutoff ratio of line with page to call as para
+# para margin to club lines into paragraphs
+# column margin horizontal margin between columns
+parsing_modes = {
+    'standard': {
+        'line_margin': 10,
+        'merge_margin': 15,
+        'adj_margin': 15,
+        'large_cutoff': 0.6,
+        'para_margin': 20,
+        'column_margin': 20
+    },
+
+    'simplespaced': {
+        'line_margin': 10,
+        'merge_margin': 30,
+        'adj_margin': 15,
+        'large_cutoff': 0.6,
+        'para_margin': 20,
+        'column_margin': 20
+    }
+}
@@ -23,14 +23,20 @@ import logging
 import shutil
 import glob
 import itertools
+import re
+from collections import deque
 from functools import wraps
+from multiprocessing import Pool
 
 from PIL import Image
+from PyPDF2 import PdfFileReader
 
 from pypdfocr.pypdfocr_pdf import PyPdf
 from pypdfocr.pypdfocr_tesseract import PyTesseract
 from pypdfocr.pypdfocr_gs import PyGs
 from pypdfocr.pypdfocr_preprocess import PyPreprocess
+from pypdfocr.pypdfocr_interrupts import init_worker
+from pypdfocr.pypdfocr_cache import PyOcrCache, file_digest
 
 
 def error(text):
@@ -54,6 +60,45 @@ def retry(count=5, exc_type=Exception):
     return decorator
 
 
+# Ugly hack to pass in object method to the multiprocessing library
+# Basically gets passed in a pair of (self, arg), and calls the method
+# error() exits, which would kill the worker and leave its result unresolved
+# forever, so the exit is turned into an exception for the caller
+def unwrap_ocr_page(arg, **kwarg):
+    try:
+        return PyPDFOCR._ocr_page(*arg, **kwarg)
+    except SystemExit:
+        raise RuntimeError("OCR of %s failed" % arg[1])
+
+
+def unwrap_ocr_image(arg, **kwarg):
+    try:
+        return PyPDFOCR._ocr_image(*arg, **kwarg)
+    except SystemExit:
+        raise RuntimeError("OCR of %s failed" % arg[1])
+
+
+def unwrap_ocr_stream(arg, **kwarg):
+    try:
+        return PyPDFOCR._ocr_page_stream(*arg, **kwarg)
+    except SystemExit:
+        raise RuntimeError("OCR of pages %d-%d of %s failed" % (arg[2], arg[3], arg[1]))
+
+
+def page_runs(pages, size):
+    """
+        Split sorted page numbers into (first, last) runs of consecutive pages,
+        each at most size pages long
+    """
+    runs = []
+    for page in pages:
+        if runs and runs[-1][1] == page - 1 and page - runs[-1][0] < size:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return [tuple(run) for run in runs]
+
+
 @retry(count=6, exc_type=IOError)
 def open_file_with_timeout(parser, arg):
     f = open(arg, 'r')
@@ -82,10 +127,58 @@ class PyPDFOCR(object):
         * 
     """
 
+    # title attribute of the ocr_page element of a hocr file
+    regex_page_title = re.compile(r'''(class=['"]ocr_page['"][^>]*?title=(['"]))(.*?)\2''')
+
     def __init__(self):
         """ Initializes the GhostScript, Tesseract, and PDF helper classes.
         """
         self.config = {}
+        self.pool = None
+        self.pages_seen = 0
+        self.pages_skipped = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(terminate=exc_type is not None)
+
+    def __getstate__(self):
+        # The worker pool stays with the process that owns it
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+    def start(self):
+        """
+            Set up the external tools and a pool of OCR workers once, to be
+            reused by every file converted with go() until close() is called.
+            The config must be filled in before.
+        """
+        if self.pool is not None:
+            return
+        self._setup_external_tools()
+        logging.debug("Making pool for OCR workers")
+        self.pool = Pool(processes=self.ts.threads, initializer=init_worker)
+
+    def close(self, terminate=False):
+        """
+            Shut down the pool of OCR workers and trim the OCR cache to its size
+
+            :param terminate: Stop the workers without waiting for their tasks
+        """
+        if getattr(self, 'cache', None):
+            self.cache.prune()
+        if self.pool is None:
+            return
+        if terminate:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+        self.pool = None
 
     def get_options(self, argv):
         """
@@ -220,10 +313,77 @@ class PyPDFOCR(object):
         self.ts = PyTesseract(self.config.get('tesseract', {}))
         self.pdf = PyPdf(self.gs)
         self.preprocess = PyPreprocess(self.config.get('preprocess', {}))
+        self.pipeline = self.config.get('pipeline', {})
+        self.text_probe = self.config.get('text_probe', {})
+        self.triage = self.config.get('triage', {})
+        self.cache = PyOcrCache(self.config['cache']) if 'cache' in self.config else None
+        self.document_key = None
 
         return
 
-    def run_conversion(self, pdf_filename):
+    def _add_scan_res(self, hocr, dpi):
+        """
+            Record the rendering dpi as the scan_res property of each ocr_page
+        """
+        return self.regex_page_title.sub(
+            lambda m: m.group(0) if 'scan_res' in m.group(3) else
+            '%s%s; scan_res %d %d%s' % (m.group(1), m.group(3), dpi, dpi, m.group(2)), hocr)
+
+    def _keep_hocr(self, hocr_filenames, hocr_dir, dpi, pages=None):
+        """
+            Copy the hocr of every page into hocr_dir as page_0001.hocr, page_0002.hocr, ...
+            The rendering dpi is recorded as the scan_res property of each ocr_page
+
+            :param hocr_filenames: List of (image, hocr) filename pairs
+            :param hocr_dir: Directory to copy the hocr files to
+            :param dpi: DPI the pages were rendered at
+            :param pages: Sorted page numbers of the hocr files, or None if they are all pages
+        """
+        if not os.path.isdir(hocr_dir):
+            os.makedirs(hocr_dir)
+        hocr_pages = sorted(hocr_filenames, key=lambda x: self.pdf.natural_keys(x[0]))
+        for page_num, (img_filename, hocr_filename) in zip(pages or itertools.count(1), hocr_pages):
+            with open(hocr_filename, encoding='utf-8') as f:
+                hocr = self._add_scan_res(f.read(), dpi)
+            out_filename = os.path.join(hocr_dir, "page_%04d.hocr" % page_num)
+            with open(out_filename, 'w', encoding='utf-8') as f:
+                f.write(hocr)
+            logging.info("Kept hocr of page %d as %s" % (page_num, out_filename))
+
+    def scan_pages(self, pdf_filename, dpi, pages=None):
+        """
+            Quick OCR at a low resolution without preprocessing, to find the pages
+            worth a full conversion
+
+            :param dpi: Resolution to render the pages at
+            :param pages: Sorted page numbers to scan, starting from 1, or None for all
+            :returns: Dict of page number to hocr text
+        """
+        self.gs._setup_img_format(pdf_filename)
+        if pages is None:
+            with open(pdf_filename, 'rb') as f:
+                pages = list(range(1, PdfFileReader(f).getNumPages() + 1))
+
+        fns = []
+        hocr_filenames = []
+        hocr = {}
+        try:
+            for first_page, last_page in page_runs(pages, len(pages)):
+                fns.extend(self.gs.make_img_from_pdf_pages(
+                    pdf_filename, first_page, last_page, dpi))
+            hocr_filenames, _ = self._ocr_files(fns, preprocess=False)
+            hocr_filenames.sort(key=lambda x: self.pdf.natural_keys(x[0]))
+            for page_num, (img_filename, hocr_filename) in zip(pages, hocr_filenames):
+                with open(hocr_filename, encoding='utf-8') as f:
+                    hocr[page_num] = self._add_scan_res(f.read(), dpi)
+        finally:
+            if not self.debug:
+                self._clean_up_files(fns)
+                for ext in [".hocr", ".html", ".txt"]:
+                    self._clean_up_files([os.path.splitext(fn)[0]+ext for fn in fns])
+        return hocr
+
+    def run_conversion(self, pdf_filename, hocr_dir=None, overlay=True, pages=None):
         """
             Does the following:
 
@@ -234,36 +394,46 @@ class PyPDFOCR(object):
 
             :param pdf_filename: Scanned PDF
             :type pdf_filename: string
-            :returns: OCR'ed PDF
+            :param hocr_dir: Directory to keep the hocr of every page in, or None
+            :param overlay: Whether to create the OCR'ed PDF
+            :param pages: Sorted page numbers to OCR, starting from 1, or None for all
+            :returns: OCR'ed PDF or None if overlay is False
             :rtype: filename string
         """
         print(("Starting conversion of %s" % pdf_filename))
         try:
             # Make the images for Tesseract
-            img_dpi, glob_img_filename = self.gs.make_img_from_pdf(
-                pdf_filename)
+            if pages is None:
+                img_dpi, glob_img_filename = self.gs.make_img_from_pdf(
+                    pdf_filename)
 
-            fns = glob.glob(glob_img_filename)
+                fns = glob.glob(glob_img_filename)
+            else:
+                img_dpi = self.gs._setup_img_format(pdf_filename)
+                fns = []
+                for first_page, last_page in page_runs(pages, len(pages)):
+                    fns.extend(self.gs.make_img_from_pdf_pages(
+                        pdf_filename, first_page, last_page))
 
         except Exception:
             raise
 
         try:
-            # Preprocess
-            if not self.skip_preprocess:
-                preprocess_imagefilenames = self.preprocess.preprocess(fns)
-            else:
-                logging.info("Skipping preprocess step")
-                preprocess_imagefilenames = fns
-            # Run teserract
-            self.ts.lang = self.lang
-            hocr_filenames = self.ts.make_hocr_from_pnms(
-                preprocess_imagefilenames)
+            # Preprocess and run tesseract
+            hocr_filenames, preprocess_imagefilenames = self._ocr_files(fns)
+            self._cache_document(img_dpi, hocr_filenames, pages=pages)
+
+            # Keep the hocr to build the layout from it directly
+            if hocr_dir:
+                self._keep_hocr(hocr_filenames, hocr_dir, img_dpi, pages)
 
             # Generate new pdf with overlayed text
             #ocr_pdf_filename = self.pdf.overlay_hocr(tiff_dpi, hocr_filename, pdf_filename)
-            ocr_pdf_filename = self.pdf.overlay_hocr_pages(
-                img_dpi, hocr_filenames, pdf_filename)
+            if overlay:
+                ocr_pdf_filename = self.pdf.overlay_hocr_pages(
+                    img_dpi, hocr_filenames, pdf_filename, page_numbers=pages)
+            else:
+                ocr_pdf_filename = None
 
         finally:
             # Clean up the files
@@ -273,6 +443,8 @@ class PyPDFOCR(object):
                 if "fns" in locals():  # Have to check if this was set before exception raised
                     logging.info("Cleaning up %s" % fns)
                     self._clean_up_files(fns)
+                    # hocr of pages taken from the cache
+                    self._clean_up_files([os.path.splitext(fn)[0]+".hocr" for fn in fns])
 
                 if "preprocess_imagefilenames" in locals():  # Have to check if this was set before exception raised
                     logging.info("Cleaning up %s" % preprocess_imagefilenames)
@@ -289,19 +461,406 @@ class PyPDFOCR(object):
                     # Seems like newer tessearct > 3.03 is now creating .txt files with the OCR text?/?
                     #self._clean_up_files([x[1].replace(".hocr", ".txt") for x in hocr_filenames])
 
-        print(("Completed conversion successfully to %s" % ocr_pdf_filename))
+        print(("Completed conversion successfully to %s" % (ocr_pdf_filename or hocr_dir)))
+        return ocr_pdf_filename
+
+
+    def _ocr_settings(self, preprocess=True):
+        """
+            Settings that change the OCR of a page image, part of every cache key
+        """
+        return {'lang': self.lang, 'backend': self.ts.backend,
+                'preprocess': None if self.skip_preprocess or not preprocess else self.preprocess.engine}
+
+    def _from_cache(self, key, img_filename):
+        """
+            Write the cached hocr of a page next to its image
+
+            :returns: (image, hocr) filename pair and (width, height, dpi) of the page,
+                      or None if the page is not cached
+        """
+        entry = self.cache.get(key) if self.cache else None
+        if entry is None:
+            return None
+        hocr_filename = "%s.hocr" % os.path.splitext(img_filename)[0]
+        with open(hocr_filename, 'w', encoding='utf-8') as f:
+            f.write(entry['hocr'])
+        width, height, dpi = entry['dims']
+        return (img_filename, hocr_filename), (width, height, tuple(dpi))
+
+    def _to_cache(self, key, hocr_filename, img_dims):
+        if self.cache:
+            with open(hocr_filename, encoding='utf-8') as f:
+                self.cache.put(key, {'hocr': f.read(), 'dims': list(img_dims)})
+
+    def _ocr_files(self, fns, preprocess=True):
+        """
+            Preprocess and OCR page image files on the worker pool, pages with
+            the same image and settings as a cached page are not OCR'ed again
+
+            :returns: List of (image, hocr) filename pairs and list of the
+                      preprocessed images
+        """
+        hocr_filenames = []
+        keys = {}
+        if self.cache:
+            settings = self._ocr_settings(preprocess)
+            for fn in fns:
+                with open(fn, 'rb') as f:
+                    keys[fn] = self.cache.key(settings, f.read())
+                hit = self._from_cache(keys[fn], fn)
+                if hit:
+                    hocr_filenames.append(hit[0])
+            cached = set(pair[0] for pair in hocr_filenames)
+            fns = [fn for fn in fns if fn not in cached]
+            if hocr_filenames:
+                logging.info("Took %d pages from the OCR cache" % len(hocr_filenames))
+        if not fns:
+            return hocr_filenames, []
+
+        self.ts.lang = self.lang
+        if preprocess and not self.skip_preprocess and self.preprocess.engine == 'numpy':
+            # Each page is preprocessed and OCR'ed in memory by one task
+            preprocess_imagefilenames = ['%s_preprocess.png' % os.path.splitext(fn)[0] for fn in fns]
+            pool = self.pool or Pool(processes=self.ts.threads, initializer=init_worker)
+            try:
+                ocr_filenames = pool.map(unwrap_ocr_image, [(self, fn) for fn in fns])
+            finally:
+                if pool is not self.pool:
+                    pool.terminate()
+                    pool.join()
+        else:
+            # Preprocess
+            if preprocess and not self.skip_preprocess:
+                preprocess_imagefilenames = self.preprocess.preprocess(
+                    fns, self.pool)
+            else:
+                logging.info("Skipping preprocess step")
+                preprocess_imagefilenames = fns
+            # Run teserract
+            ocr_filenames = self.ts.make_hocr_from_pnms(
+                preprocess_imagefilenames, self.pool)
+        for fn, (img_filename, hocr_filename) in zip(fns, ocr_filenames):
+            if fn in keys:
+                self._to_cache(keys[fn], hocr_filename, self.pdf._get_img_dims(fn))
+        return hocr_filenames + ocr_filenames, preprocess_imagefilenames
+
+    def _cache_document(self, img_dpi, hocr_filenames, page_dims=None, pages=None):
+        """
+            Store the hocr of all OCR'ed pages of the file being converted, so the
+            same file is converted without text probe, triage, rendering or OCR
+            next time
+
+            :param pages: Sorted page numbers that were OCR'ed, or None for all
+        """
+        if not self.cache or not self.document_key:
+            return
+        hocr_pages = sorted(hocr_filenames, key=lambda x: self.pdf.natural_keys(x[0]))
+        entry = {'dpi': img_dpi, 'ocr_pages': pages, 'pages': []}
+        for img_filename, hocr_filename in hocr_pages:
+            img_dims = (page_dims or {}).get(img_filename) or self.pdf._get_img_dims(img_filename)
+            with open(hocr_filename, encoding='utf-8') as f:
+                entry['pages'].append({'hocr': f.read(), 'dims': list(img_dims)})
+        self.cache.put(self.document_key, entry)
+
+    def run_cached(self, pdf_filename, hocr_dir=None, overlay=True):
+        """
+            Convert a file that was converted before with the same settings from
+            the hocr of its pages in the cache, OCR'ing the same pages as then
+
+            :returns: OCR'ed PDF or None if overlay is False, or False if the file is not cached
+        """
+        entry = self.cache.get(self.document_key) if self.cache and self.document_key else None
+        if entry is None:
+            return False
+        print(("Converting %s from the OCR cache" % pdf_filename))
+        pages = entry['ocr_pages']
+        filename = os.path.splitext(pdf_filename)[0]
+        hocr_filenames = []
+        page_dims = {}
+        try:
+            for page_num, page in enumerate(entry['pages'], 1):
+                img_filename = '%s_%d.cached' % (filename, page_num)
+                hocr_filename = '%s_%d.hocr' % (filename, page_num)
+                with open(hocr_filename, 'w', encoding='utf-8') as f:
+                    f.write(page['hocr'])
+                hocr_filenames.append((img_filename, hocr_filename))
+                width, height, dpi = page['dims']
+                page_dims[img_filename] = (width, height, tuple(dpi))
+
+            if hocr_dir:
+                self._keep_hocr(hocr_filenames, hocr_dir, entry['dpi'], pages)
+            if overlay:
+                ocr_pdf_filename = self.pdf.overlay_hocr_pages(
+                    entry['dpi'], hocr_filenames, pdf_filename, page_dims, pages)
+            else:
+                ocr_pdf_filename = None
+        finally:
+            if not self.debug:
+                self._clean_up_files([hocr_filename for _, hocr_filename in hocr_filenames])
+
+        print(("Completed conversion successfully to %s" % (ocr_pdf_filename or hocr_dir)))
         return ocr_pdf_filename
 
+    def _ocr_image(self, img_filename):
+        """
+            Preprocess a page image with NumPy and OCR it without writing the
+            preprocessed image.  Runs in a worker process
 
-    def go(self, filename):
+            :returns: The (image, hocr) filename pair, the hocr is named after the
+                      preprocessed image
+        """
+        image = self.preprocess.preprocess_image(Image.open(img_filename))
+        hocr_filename = self.ts.make_hocr_from_image(
+            image, '%s_preprocess.png' % os.path.splitext(img_filename)[0])
+        self.preprocess.unskew(hocr_filename, image)
+        return img_filename, hocr_filename
+
+    def _ocr_page(self, img_filename):
+        """
+            Preprocess and OCR a single page image, then delete the images
+            Runs in a worker process of the pipeline
+
+            :param img_filename: Page image rendered by Ghostscript
+            :returns: List with the (image, hocr) filename pair and (width, height, dpi) of the page
+        """
+        fns = [img_filename]
+        try:
+            if self.cache:
+                with open(img_filename, 'rb') as f:
+                    key = self.cache.key(self._ocr_settings(), f.read())
+                hit = self._from_cache(key, img_filename)
+                if hit:
+                    return [hit]
+            img_dims = self.pdf._get_img_dims(img_filename)
+            if self.skip_preprocess:
+                hocr_filename = self.ts.make_hocr_from_pnm(img_filename)
+            elif self.preprocess.engine == 'numpy':
+                # The preprocessed page goes to OCR without being written, unless
+                # the tesseract binary has to read it from a file
+                image = self.preprocess.preprocess_image(Image.open(img_filename))
+                fns.append('%s_preprocess.png' % os.path.splitext(img_filename)[0])
+                hocr_filename = self.ts.make_hocr_from_image(image, fns[-1])
+                self.preprocess.unskew(hocr_filename, image)
+            else:
+                fns.append(self.preprocess._run_preprocess(img_filename))
+                hocr_filename = self.ts.make_hocr_from_pnm(fns[-1])
+            if self.cache:
+                self._to_cache(key, hocr_filename, img_dims)
+        finally:
+            if not self.debug:
+                self._clean_up_files(set(fns))
+        return [((fns[-1], hocr_filename), img_dims)]
+
+    def _ocr_page_stream(self, pdf_filename, first_page, last_page):
+        """
+            Render a run of pages through a pipe, then preprocess and OCR each page
+            in memory.  Runs in a worker process of the pipeline
+
+            :returns: List of (image, hocr) filename pairs and (width, height, dpi) of the
+                      pages, the image files are never written
+        """
+        filename = os.path.splitext(pdf_filename)[0]
+        results = []
+        for page_num, image in enumerate(self.gs.iter_img_from_pdf_pages(
+                pdf_filename, first_page, last_page), first_page):
+            img_filename = '%s_%d.pnm' % (filename, page_num)
+            dpi = image.info['dpi']
+            img_dims = (image.width*72.0/dpi[0], image.height*72.0/dpi[1], dpi)
+            if self.cache:
+                key = self.cache.key(self._ocr_settings(), image.mode, str(image.size), image.tobytes())
+                hit = self._from_cache(key, img_filename)
+                if hit:
+                    results.append(hit)
+                    continue
+            if self.skip_preprocess:
+                pass
+            elif self.preprocess.engine == 'numpy':
+                image = self.preprocess.preprocess_image(image)
+            else:
+                # ImageMagick needs files, png keeps the page lossless
+                fns = ['%s_%d.png' % (filename, page_num)]
+                try:
+                    image.save(fns[0], dpi=dpi)
+                    fns.append(self.preprocess._run_preprocess(fns[0]))
+                    image = Image.open(fns[-1])
+                    image.load()
+                finally:
+                    self._clean_up_files(set(fns))
+            hocr_filename = self.ts.make_hocr_from_image(image, img_filename)
+            self.preprocess.unskew(hocr_filename, image)
+            if self.cache:
+                self._to_cache(key, hocr_filename, img_dims)
+            results.append(((img_filename, hocr_filename), img_dims))
+        return results
+
+    def run_pipeline(self, pdf_filename, hocr_dir=None, overlay=True, pages=None):
+        """
+            Same as run_conversion, but pages are rendered by Ghostscript in chunks
+            and handed to the OCR workers as soon as they are written, so rendering
+            and OCR overlap.  At most depth pages wait for OCR at any time and the
+            images of a page are deleted once it is OCR'ed.  When Ghostscript streams,
+            each worker renders its run of pages to a pipe and no images are written.
+
+            :param pdf_filename: Scanned PDF
+            :param hocr_dir: Directory to keep the hocr of every page in, or None
+            :param overlay: Whether to create the OCR'ed PDF
+            :param pages: Sorted page numbers to OCR, starting from 1, or None for all
+            :returns: OCR'ed PDF or None if overlay is False
+        """
+        print(("Starting pipelined conversion of %s" % pdf_filename))
+        chunk_pages = self.pipeline.get('chunk_pages', 4)
+        depth = self.pipeline.get('depth', 2 * self.ts.threads)
+        img_dpi = self.gs._setup_img_format(pdf_filename)
+        if pages is None:
+            with open(pdf_filename, 'rb') as f:
+                num_pages = PdfFileReader(f).getNumPages()
+            runs = page_runs(range(1, num_pages + 1), chunk_pages)
+        else:
+            runs = page_runs(pages, chunk_pages)
+
+        self.ts.lang = self.lang
+        hocr_filenames = []
+        page_dims = {}
+        pending = deque()
+
+        def collect():
+            for hocr_pair, img_dims in pending.popleft().get():
+                hocr_filenames.append(hocr_pair)
+                page_dims[hocr_pair[0]] = img_dims
+
+        # Use the workers of start() if running, otherwise a pool for this file
+        pool = self.pool or Pool(processes=self.ts.threads, initializer=init_worker)
+        try:
+            try:
+                for first_page, last_page in runs:
+                    if self.gs.stream:
+                        # Workers render their own pages through a pipe
+                        while len(pending) * chunk_pages >= depth:
+                            collect()
+                        pending.append(pool.apply_async(
+                            unwrap_ocr_stream, ((self, pdf_filename, first_page, last_page),)))
+                        continue
+                    for fn in self.gs.make_img_from_pdf_pages(pdf_filename, first_page, last_page):
+                        while len(pending) >= depth:
+                            collect()
+                        pending.append(pool.apply_async(unwrap_ocr_page, ((self, fn),)))
+                while pending:
+                    collect()
+                if pool is not self.pool:
+                    pool.close()
+            except KeyboardInterrupt:
+                print("Caught keyboard interrupt... terminating")
+                pool.terminate()
+                raise
+            except Exception:
+                # Let pages already handed out finish before cleaning up, but
+                # stop the workers if they do not finish in time
+                deadline = time.time() + self.pipeline.get('error_timeout', 60)
+                for result in pending:
+                    result.wait(max(0, deadline - time.time()))
+                if pool is not self.pool:
+                    pool.terminate()
+                elif not all(result.ready() for result in pending):
+                    self.close(terminate=True)
+                raise
+            finally:
+                if pool is not self.pool:
+                    pool.join()
+
+            self._cache_document(img_dpi, hocr_filenames, page_dims, pages)
+
+            # Keep the hocr to build the layout from it directly
+            if hocr_dir:
+                self._keep_hocr(hocr_filenames, hocr_dir, img_dpi, pages)
+
+            if overlay:
+                ocr_pdf_filename = self.pdf.overlay_hocr_pages(
+                    img_dpi, hocr_filenames, pdf_filename, page_dims, pages)
+            else:
+                ocr_pdf_filename = None
+
+        finally:
+            if not self.debug:
+                # Images of pages that were never OCR'ed, and all hocr output
+                filename = os.path.splitext(pdf_filename)[0]
+                self._clean_up_files(glob.glob('%s_*.%s' % (filename, self.gs.img_file_ext)))
+                for ext in [".hocr", ".html", ".txt"]:
+                    fns_to_remove = [os.path.splitext(fn)[0]+ext for fn, _ in hocr_filenames]
+                    self._clean_up_files(fns_to_remove)
+
+        print(("Completed conversion successfully to %s" % (ocr_pdf_filename or hocr_dir)))
+        return ocr_pdf_filename
+
+    def _copy_text_pdf(self, pdf_filename):
+        """
+            Every page has a text layer, so the OCR'ed PDF is the original
+
+            :returns: OCR'ed PDF filename
+        """
+        pdf_dir, pdf_basename = os.path.split(pdf_filename)
+        basename = os.path.splitext(pdf_basename)[0]
+        ocr_pdf_filename = os.path.join(pdf_dir, "%s_ocr.pdf" % (basename))
+        shutil.copyfile(pdf_filename, ocr_pdf_filename)
+        print(("All pages of %s have a text layer, skipped OCR" % pdf_filename))
+        return ocr_pdf_filename
+
+    def go(self, filename, hocr_dir=None, overlay=True, page_filter=None):
+        """
+            :param page_filter: Optional function called with the hocr of a low resolution
+                                scan of the pages to OCR, as a dict of page number to hocr text.
+                                It returns the page numbers to OCR fully, or None to OCR them all
+        """
 
         # setup arguments
         self.skip_preprocess = False
         self.debug = False
         self.lang = "eng"
 
-        # Setup tesseract and ghostscript
-        self._setup_external_tools()
+        # Setup tesseract and ghostscript, once for all files when started
+        if self.pool is None:
+            self._setup_external_tools()
+
+        # A file converted before with the same settings needs neither the
+        # text probe, triage, rendering nor OCR
+        probe = overlay and not hocr_dir
+        min_chars = self.text_probe.get('min_chars', 0) if probe else 0
+        if self.cache:
+            self.document_key = self.cache.key(
+                dict(self._ocr_settings(), stream=self.gs.stream, min_chars=min_chars,
+                     triage=self.triage if page_filter is not None else None),
+                file_digest(filename))
+            ocr_pdf_filename = self.run_cached(filename, hocr_dir, overlay)
+            if ocr_pdf_filename is not False:
+                return ocr_pdf_filename
+
+        # Pages that already have a text layer need no OCR, the hocr of
+        # every page is kept in order so all pages are OCR'ed then
+        pages = None
+        if min_chars:
+            has_text = self.pdf.probe_text_layer(filename, min_chars)
+            pages = [num for num, text in enumerate(has_text, 1) if not text]
+            self.pages_seen += len(has_text)
+            self.pages_skipped += len(has_text) - len(pages)
+            if len(pages) == len(has_text):
+                pages = None
+            elif not pages:
+                return self._copy_text_pdf(filename)
+            else:
+                print(("Skipping OCR on %d of %d pages with a text layer" %
+                       (len(has_text) - len(pages), len(has_text))))
+
+        # Two passes, a quick scan picks the pages for the full conversion
+        if page_filter is not None:
+            scanned = self.scan_pages(filename, self.triage.get('dpi', 100), pages)
+            chosen = page_filter(scanned)
+            if chosen:
+                pages = sorted(chosen)
+                print(("Triage picked %d of %d pages for OCR" % (len(pages), len(scanned))))
+            else:
+                print("Triage found no pages, running OCR on all pages")
 
         # Will only receive filename as argument
-        self.run_conversion(filename)
+        if self.pipeline.get('chunk_pages') or self.gs.stream:
+            return self.run_pipeline(filename, hocr_dir, overlay, pages)
+        return self.run_conversion(filename, hocr_dir, overlay, pages)
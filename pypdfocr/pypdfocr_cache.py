@@ -0,0 +1,128 @@
+#!/usr/bin/env python2.7
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Content addressed cache of OCR results.  Entries are json files named by a
+    hash of what was OCR'ed and the settings it was OCR'ed with, so renamed
+    files and pages repeated across files are found again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+
+
+def file_digest(filename):
+    """
+        :rval: sha256 hex digest of the content of a file
+    """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PyOcrCache(object):
+    """Directory of cached OCR results with a size cap"""
+
+    def __init__(self, config):
+        self.cache_dir = config['dir']
+        self.max_bytes = config.get('max_bytes', 1 << 30)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, settings, *parts):
+        """
+            Hash of the settings and the parts, which are bytes or strings
+
+            :param settings: Dict of everything that changes the result
+        """
+        h = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            # Length prefix, so no two lists of parts hash the same
+            h.update(struct.pack('<Q', len(part)))
+            h.update(part)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        """
+            :rval: Cached value or None
+        """
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                value = json.load(f)
+        except (IOError, ValueError):
+            return None
+        # The modification time orders entries for eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        logging.debug("OCR cache hit %s" % key)
+        return value
+
+    def put(self, key, value):
+        """
+            Store a json serializable value, replacing the file atomically so
+            concurrent workers never read a partial entry
+        """
+        path = self._path(key)
+        entry_dir = os.path.dirname(path)
+        if not os.path.isdir(entry_dir):
+            os.makedirs(entry_dir, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(tmp_filename, path)
+        except Exception:
+            os.remove(tmp_filename)
+            raise
+
+    def prune(self):
+        """
+            Evict the least recently used entries until the cache fits max_bytes
+
+            :rval: Size of the cache in bytes
+        """
+        entries = []
+        total = 0
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith('.json'):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        return total
@@ -25,12 +25,47 @@ import os
 import logging
 import glob
 
+from PIL import Image
+
 
 def error(text):
     print(("ERROR: %s" % text))
     exit(-1)
 
 
+def read_pnm(f):
+    """
+        Read one binary PGM (P5) or PPM (P6) image from a stream
+
+        :rval: PIL image, or None at the end of the stream
+    """
+    tokens = []
+    token = b''
+    while len(tokens) < 4:
+        c = f.read(1)
+        if not c:
+            if tokens or token:
+                raise IOError("Truncated PNM header")
+            return None
+        if c == b'#' and not token:
+            f.readline()
+        elif c.isspace():
+            if token:
+                tokens.append(token)
+                token = b''
+        else:
+            token += c
+    magic, width, height, maxval = tokens[0], int(tokens[1]), int(tokens[2]), int(tokens[3])
+    if magic not in (b'P5', b'P6') or maxval > 255:
+        raise IOError("Unsupported PNM image %s" % magic)
+    mode = 'L' if magic == b'P5' else 'RGB'
+    size = width * height * (1 if mode == 'L' else 3)
+    data = f.read(size)
+    if len(data) != size:
+        raise IOError("Truncated PNM image")
+    return Image.frombytes(mode, (width, height), data)
+
+
 class PyGs(object):
     """Class to wrap all the ghostscript calls"""
 
@@ -42,6 +77,8 @@ class PyGs(object):
             'GS_MISSING_BINARY': 'Could not find Ghostscript in the usual place; please specify it using your config file',
         }
         self.threads = config.get('threads', 4)
+        # Stream raw pages through a pipe instead of writing image files
+        self.stream = config.get('stream', False)
 
         if "binary" in config:  # Override location of binary
             binary = config['binary']
@@ -119,6 +156,10 @@ class PyGs(object):
         pass
 
     def _get_dpi(self, pdf_filename):
+        # The same object renders every file of a batch, so start from the
+        # defaults instead of whatever the previous file left behind
+        self.output_dpi = 300
+        self.greyscale = True
         if not os.path.exists(pdf_filename):
             error(self.msgs['GS_MISSING_PDF'] + " %s" % pdf_filename)
 
@@ -190,14 +231,17 @@ class PyGs(object):
             else:
                 error(self.msgs['GS_FAILED'])
 
-    def make_img_from_pdf(self, pdf_filename):
+    def _setup_img_format(self, pdf_filename):
+        """
+            Pick the dpi and image format for rendering the pages of pdf_filename
+
+            :rval: The rendering dpi
+        """
         self._get_dpi(pdf_filename)  # No need to bother anymore
 
         if not os.path.exists(pdf_filename):
             error(self.msgs['GS_MISSING_PDF'] + " %s" % pdf_filename)
 
-        filename, filext = os.path.splitext(pdf_filename)
-
         # Create ancillary jpeg files to use later to calculate image dpi etc
         #   We no longer use these for the final image. Instead the text is merged
         #   directly with the original PDF.  Yay!
@@ -211,6 +255,12 @@ class PyGs(object):
             logging.info("Detected color")
 
         self.img_file_ext = self.gs_options[self.img_format][0]
+        return self.output_dpi
+
+    def make_img_from_pdf(self, pdf_filename):
+        self._setup_img_format(pdf_filename)
+
+        filename, filext = os.path.splitext(pdf_filename)
 
         # The possible output files glob
         globable_filename = '%s_*.%s' % (filename, self.img_file_ext)
@@ -225,3 +275,63 @@ class PyGs(object):
         for fn in glob.glob(globable_filename):
             logging.info("Created image %s" % fn)
         return (self.output_dpi, globable_filename)
+
+    def make_img_from_pdf_pages(self, pdf_filename, first_page, last_page, dpi=None):
+        """
+            Render a range of pages, named like the pages of make_img_from_pdf
+            _setup_img_format must have been called for pdf_filename
+
+            :param first_page: First page to render, starting from 1
+            :param last_page: Last page to render, inclusive
+            :param dpi: Resolution to render at instead of the detected one
+            :rval: List of image filenames in page order
+        """
+        filename, filext = os.path.splitext(pdf_filename)
+
+        # Ghostscript numbers the output of every run from 1, so render to
+        # a chunk name and rename the images to their page numbers
+        options = ' '.join(self.gs_options[self.img_format][1]) % {
+            'dpi': dpi or self.output_dpi}
+        options = '-dFirstPage=%d -dLastPage=%d %s' % (first_page, last_page, options)
+        chunk_filename = '%s_chunk%d_%%d.%s' % (filename, first_page, self.img_file_ext)
+        self._run_gs(options, chunk_filename, pdf_filename)
+
+        fns = []
+        for page_num in range(first_page, last_page + 1):
+            fn = '%s_%d.%s' % (filename, page_num, self.img_file_ext)
+            os.replace(chunk_filename % (page_num - first_page + 1), fn)
+            logging.info("Created image %s" % fn)
+            fns.append(fn)
+        return fns
+
+    def iter_img_from_pdf_pages(self, pdf_filename, first_page, last_page, dpi=None):
+        """
+            Render a range of pages as raw PGM, or PPM for colour pages, to a pipe and
+            yield them as PIL images, without image files or lossy compression
+            _setup_img_format must have been called for pdf_filename
+
+            :param first_page: First page to render, starting from 1
+            :param last_page: Last page to render, inclusive
+            :param dpi: Resolution to render at instead of the detected one
+        """
+        dpi = dpi or self.output_dpi
+        device = 'pgmraw' if self.greyscale else 'ppmraw'
+        cmd = '%s -q -dNOPAUSE -dBATCH -sDEVICE=%s -r%d -dFirstPage=%d -dLastPage=%d -sOutputFile=- "%s"' % (
+            self.binary, device, dpi, first_page, last_page, pdf_filename)
+        logging.info(cmd)
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
+        try:
+            while True:
+                img = read_pnm(proc.stdout)
+                if img is None:
+                    break
+                img.info['dpi'] = (dpi, dpi)
+                yield img
+            proc.wait()
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
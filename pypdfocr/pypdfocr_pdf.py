@@ -47,15 +47,12 @@ from xml.etree.ElementTree import ElementTree, ParseError
 import xml.etree
 
 # Import Pypdf2
-from PyPDF2 import PdfFileMerger, PdfFileReader, PdfFileWriter, utils
+from PyPDF2 import PdfFileReader, PdfFileWriter, utils
 
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.enums import TA_LEFT
 from reportlab.platypus.paragraph import Paragraph
 
-from pypdfocr.pypdfocr_util import Retry
-from functools import partial
-
 
 class RotatedPara(Paragraph):
     """
@@ -132,7 +129,13 @@ class PyPdf(object):
                                                  ctm[1][0], ctm[1][1],
                                                  ctm[2][0], ctm[2][1]])
 
-    def overlay_hocr_pages(self, dpi, hocr_filenames, orig_pdf_filename):
+    def overlay_hocr_pages(self, dpi, hocr_filenames, orig_pdf_filename, page_dims=None, page_numbers=None):
+        """
+            :param page_dims: Optional dict of image filename to (width, height, dpi),
+                              for pages whose images were already deleted
+            :param page_numbers: Optional sorted page numbers, starting from 1, that the
+                                 hocr files belong to.  Other pages are copied unchanged
+        """
 
         logging.debug("Going to overlay following files onto %s" %
                       orig_pdf_filename)
@@ -144,46 +147,43 @@ class PyPdf(object):
         basename = os.path.splitext(pdf_basename)[0]
         pdf_filename = os.path.join(pdf_dir, "%s_ocr.pdf" % (basename))
 
-        text_pdf_filenames = []
+        # Draw the text layer of every page on one canvas in memory, so there
+        # are no temp pdfs to write, merge, reread and delete
+        text_file = io.BytesIO()
+        pdf = Canvas(text_file, pageCompression=1)
+        pdf.setCreator('pypdfocr')
+        pdf.setTitle(pdf_basename)
+        pdf.setPageCompression(1)
         for img_filename, hocr_filename in hocr_filenames:
-            text_pdf_filename = self.overlay_hocr_page(
-                dpi, hocr_filename, img_filename)
-            logging.info(
-                "Created temp OCR'ed pdf containing only the text as %s" % (text_pdf_filename))
-            text_pdf_filenames.append(text_pdf_filename)
-
-        # Now, concatenate this text_pdfs into one single file.
-        # This is a hack to save memory/running time when we have to do the actual merge with a writer
-
-        all_text_filename = os.path.join(pdf_dir, "%s_text.pdf" % (basename))
-        merger = PdfFileMerger()
-        for text_pdf_filename in text_pdf_filenames:
-            merger.append(PdfFileReader(open(text_pdf_filename, 'rb')))
-        merger.write(all_text_filename)
-        merger.close()
-        del merger
+            img_dims = (page_dims or {}).get(img_filename)
+            width, height, dpi_jpg = img_dims or self._get_img_dims(img_filename)
+            pdf.setPageSize((width, height))
+            logging.info("Adding text of %s, page width=%f, height=%f" %
+                         (hocr_filename, width, height))
+            self.add_text_layer(pdf, hocr_filename, 1, height, dpi)
+            pdf.showPage()
+        pdf.save()
+        text_file.seek(0)
 
         writer = PdfFileWriter()
         orig = open(orig_pdf_filename, 'rb')
-        text_file = open(all_text_filename, 'rb')
 
-        for orig_pg, text_pg in zip(self.iter_pdf_page(orig), self.iter_pdf_page(text_file)):
-            orig_pg = self._get_merged_single_page(orig_pg, text_pg)
-            writer.addPage(orig_pg)
+        if page_numbers is None:
+            for orig_pg, text_pg in zip(self.iter_pdf_page(orig), self.iter_pdf_page(text_file)):
+                orig_pg = self._get_merged_single_page(orig_pg, text_pg)
+                writer.addPage(orig_pg)
+        else:
+            page_numbers = set(page_numbers)
+            text_pgs = self.iter_pdf_page(text_file)
+            for pgnum, orig_pg in enumerate(self.iter_pdf_page(orig), 1):
+                if pgnum in page_numbers:
+                    orig_pg = self._get_merged_single_page(orig_pg, next(text_pgs))
+                writer.addPage(orig_pg)
 
         with open(pdf_filename, 'wb') as f:
-            # Flush out this page merge so we can close the text_file
             writer.write(f)
 
         orig.close()
-        text_file.close()
-
-        # Windows sometimes locks the temp text file for no reason, so we need to retry a few times to delete
-        for fn in text_pdf_filenames:
-            # os.remove(fn)
-            Retry(partial(os.remove, fn), tries=10, pause=3).call_with_retry()
-
-        os.remove(all_text_filename)
         logging.info("Created OCR'ed pdf as %s" % (pdf_filename))
 
         return pdf_filename
@@ -218,43 +218,25 @@ class PyPdf(object):
         del img
         return (width, height, dpi)
 
-    def overlay_hocr_page(self, dpi, hocr_filename, img_filename):
-        hocr_dir, hocr_basename = os.path.split(hocr_filename)
-        img_dir, img_basename = os.path.split(img_filename)
-        logging.debug("hocr_filename:%s, hocr_dir:%s, hocr_basename:%s" %
-                      (hocr_filename, hocr_dir, hocr_basename))
-        assert(img_dir == hocr_dir)
-
-        #basename = hocr_basename.split('.')[0]
-        basename = os.path.splitext(hocr_basename)[0]
-        pdf_filename = os.path.join("text_%s_ocr.pdf" % (basename))
-
-        # Switch to the hocr directory to make this easier
-        cwd = os.getcwd()
-        if hocr_dir != "":
-            os.chdir(hocr_dir)
-
-        with open(pdf_filename, "wb") as f:
-            logging.info("Overlaying hocr and creating text pdf %s" %
-                         pdf_filename)
-            pdf = Canvas(f, pageCompression=1)
-            pdf.setCreator('pypdfocr')
-            pdf.setTitle(os.path.basename(hocr_filename))
-            pdf.setPageCompression(1)
-
-            width, height, dpi_jpg = self._get_img_dims(img_basename)
-            pdf.setPageSize((width, height))
-            logging.info("Page width=%f, height=%f" % (width, height))
-
-            pg_num = 1
-
-            logging.info("Adding text to page %s" % pdf_filename)
-            self.add_text_layer(pdf, hocr_basename, pg_num, height, dpi)
-            pdf.showPage()
-            pdf.save()
+    def probe_text_layer(self, pdf_filename, min_chars):
+        """
+            Check every page for a usable text layer, i.e. at least min_chars letters
+            and digits that also make up most of the extracted text, so pages with
+            only a few stray glyphs or a garbled encoding still get OCR'ed
 
-        os.chdir(cwd)
-        return os.path.join(hocr_dir, pdf_filename)
+            :rval: List with a bool for every page
+        """
+        has_text = []
+        with open(pdf_filename, 'rb') as f:
+            for pg in self.iter_pdf_page(f):
+                try:
+                    text = pg.extractText()
+                except Exception:
+                    text = ""
+                chars = [c for c in text if not c.isspace()]
+                alnum = sum(c.isalnum() for c in chars)
+                has_text.append(alnum >= min_chars and alnum * 2 >= len(chars))
+        return has_text
 
     def iter_pdf_page(self, f):
         reader = PdfFileReader(f)
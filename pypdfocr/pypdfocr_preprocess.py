@@ -22,14 +22,22 @@
 import subprocess
 import sys
 import os
+import re
 import logging
 import glob
 import functools
 import signal
 
 from multiprocessing import Pool
+from PIL import Image
 from pypdfocr.pypdfocr_interrupts import init_worker
 
+# NumPy is only needed for the in-process preprocessing engine
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 # Ugly hack to pass in object method to the multiprocessing library
 # From http://www.rueckstiess.net/research/snippets/show/ca1d7d90
 # Basically gets passed in a pair of (self, arg), and calls the method
@@ -39,6 +47,113 @@ def unwrap_self(arg, **kwarg):
     return PyPreprocess._run_preprocess(*arg, **kwarg)
 
 
+def _window_sums(values, size):
+    """
+        Sums of values over windows of size rows, centred on each row
+    """
+    before = size // 2
+    sums = np.zeros((values.shape[0] + size,) + values.shape[1:], dtype=np.int32)
+    np.cumsum(values, axis=0, dtype=np.int32, out=sums[before + 1:before + 1 + values.shape[0]])
+    sums[before + 1 + values.shape[0]:] = sums[before + values.shape[0]]
+    return sums[size:] - sums[:-size]
+
+
+def adaptive_threshold(grey, window=15, offset=0.05):
+    """
+        Local adaptive threshold, the same as ImageMagick's -lat 15x15+5% on the
+        negated page: a pixel is ink when it is darker than the mean of the
+        window around it by more than offset of the full range
+
+        :param grey: 2d uint8 array, 0 is black
+        :rval: 2d bool array, True for ink
+    """
+    sums = _window_sums(_window_sums(grey, window).T, window).T
+    area = window * window
+    return grey.astype(np.int32) * area < sums - int(offset * 255 * area)
+
+
+def _long_runs(ink, length):
+    """
+        Pixels of ink that belong to vertical runs of at least length pixels
+    """
+    # a run starts at pixels whose next length pixels are all ink (erosion),
+    # then every pixel covered by such a start is part of the run (dilation)
+    n = ink.shape[0]
+    if n < length:
+        return np.zeros_like(ink)
+    sums = np.zeros((n + 1,) + ink.shape[1:], dtype=np.int32)
+    np.cumsum(ink, axis=0, dtype=np.int32, out=sums[1:])
+    starts = np.zeros((n + length,) + ink.shape[1:], dtype=np.int32)
+    np.cumsum((sums[length:] - sums[:n - length + 1]) == length, axis=0,
+              dtype=np.int32, out=starts[length:length + n - length + 1])
+    starts[length + n - length + 1:] = starts[length + n - length]
+    # starts[i + length] counts run starts up to row i, a pixel at row i is
+    # covered by starts from row i - length + 1 to row i
+    return starts[length:] > starts[:n]
+
+
+def remove_lines(ink, length=60):
+    """
+        Remove horizontal and vertical rules of at least length pixels, which
+        otherwise make tesseract skip text close to the lines of a table
+    """
+    return ink & ~_long_runs(ink, length) & ~_long_runs(ink.T, length).T
+
+
+def find_skew(ink, max_angle=5.0, step=0.25, samples=200000):
+    """
+        Estimate the skew of text lines in degrees, as the rotation that makes
+        the rows of ink the most uneven, i.e. lines and gaps the most distinct
+    """
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 2:
+        return 0.0
+    if len(ys) > samples:
+        keep = np.linspace(0, len(ys) - 1, samples).astype(np.int64)
+        ys, xs = ys[keep], xs[keep]
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        theta = np.radians(angle)
+        rows = np.round(ys * np.cos(theta) + xs * np.sin(theta)).astype(np.int64)
+        counts = np.bincount(rows - rows.min())
+        score = float(np.dot(counts, counts))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+BBOX = re.compile(r'bbox (\d+) (\d+) (\d+) (\d+)')
+
+
+def unskew_hocr(hocr_filename, angle, size):
+    """
+        Move the boxes of an hocr file back onto the page as it was before
+        deskewing by angle degrees, so the text layer lines up with the
+        original page.  Boxes keep their size, only their centres are rotated
+
+        :param size: (width, height) of the deskewed page
+    """
+    width, height = size
+    cx, cy = width / 2.0, height / 2.0
+    theta = np.radians(angle)
+    cos, sin = np.cos(theta), np.sin(theta)
+
+    def move(match):
+        x1, y1, x2, y2 = [int(v) for v in match.groups()]
+        dx, dy = (x1 + x2) / 2.0 - cx, (y1 + y2) / 2.0 - cy
+        x = cx + dx * cos + dy * sin
+        y = cy - dx * sin + dy * cos
+        x1, x2 = x - (x2 - x1) / 2.0, x + (x2 - x1) / 2.0
+        y1, y2 = y - (y2 - y1) / 2.0, y + (y2 - y1) / 2.0
+        return 'bbox %d %d %d %d' % (max(0, round(x1)), max(0, round(y1)),
+                                     min(width, round(x2)), min(height, round(y2)))
+
+    with open(hocr_filename, encoding='utf-8') as f:
+        hocr = f.read()
+    with open(hocr_filename, 'w', encoding='utf-8') as f:
+        f.write(BBOX.sub(move, hocr))
+
+
 class PyPreprocess(object):
     """Class to wrap all the ImageMagick convert calls"""
 
@@ -48,6 +163,13 @@ class PyPreprocess(object):
         }
         self.threads = config.get('threads', 4)
 
+        # 'convert' runs ImageMagick per page, 'numpy' works on arrays in the process
+        self.engine = config.get('engine', 'convert')
+        if self.engine == 'numpy' and np is None:
+            logging.warning("NumPy is not installed, preprocessing with ImageMagick instead")
+            self.engine = 'convert'
+        self.line_length = config.get('line_length', 60)
+
     def _warn(self, msg):  # pragma: no cover
         pass
 
@@ -64,6 +186,36 @@ class PyPreprocess(object):
             print(e.output)
             self._warn("Could not run command %s" % cmd_list)
 
+    def preprocess_image(self, image):
+        """
+            Threshold, remove table rules and deskew a page in memory
+
+            :param image: PIL image of the page
+            :rval: Black and white PIL image, with the dpi of the input and the
+                   deskew angle in info['skew'] for unskew()
+        """
+        grey = np.asarray(image.convert('L'))
+        ink = adaptive_threshold(grey)
+        ink = remove_lines(ink, self.line_length)
+        out = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8))
+        angle = find_skew(ink)
+        if angle:
+            out = out.rotate(-angle, resample=Image.BILINEAR, fillcolor=255)
+        out.info['skew'] = angle
+        if 'dpi' in image.info:
+            out.info['dpi'] = image.info['dpi']
+        return out
+
+    def unskew(self, hocr_filename, image):
+        """
+            Undo the deskew of image on the boxes of its hocr file
+
+            :param image: Preprocessed PIL image
+        """
+        angle = float(image.info.get('skew', 0))
+        if angle:
+            unskew_hocr(hocr_filename, angle, image.size)
+
     def _run_preprocess(self,  in_filename):
         basename, filext = os.path.splitext(in_filename)
         out_filename = '%s_preprocess%s' % (basename, filext)
@@ -97,8 +249,13 @@ class PyPreprocess(object):
         else:
             return out_filename
 
-    def preprocess(self, in_filenames):
+    def preprocess(self, in_filenames, pool=None):
+        """
+            :param pool: Optional worker pool to run on, left running for the caller
+        """
         fns = in_filenames
+        if pool is not None:
+            return pool.map(unwrap_self, list(zip([self]*len(fns), fns)))
 
         pool = Pool(processes=self.threads, initializer=init_worker)
         try:
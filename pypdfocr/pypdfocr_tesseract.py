@@ -19,6 +19,7 @@
    Run Tesseract to generate hocr file 
 """
 
+import io
 import os
 import sys
 import logging
@@ -29,6 +30,32 @@ from subprocess import CalledProcessError
 from multiprocessing import Pool
 from pypdfocr.pypdfocr_interrupts import init_worker
 
+# Tesseract's C API through tesserocr is optional, the binary is used without it
+try:
+    import tesserocr
+except ImportError:  # pragma: no cover
+    tesserocr = None
+
+# Initialized engines of this process by language, so every worker loads the
+# language data once instead of once per page
+_engines = {}
+
+HOCR_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <title></title>
+  <meta http-equiv="Content-Type" content="text/html;charset=utf-8" />
+  <meta name='ocr-system' content='tesseract %s' />
+  <meta name='ocr-capabilities' content='ocr_page ocr_carea ocr_par ocr_line ocrx_word'/>
+ </head>
+ <body>
+"""
+HOCR_FOOTER = """ </body>
+</html>
+"""
+
 
 def error(text):
     print(("ERROR: %s" % text))
@@ -40,7 +67,11 @@ def error(text):
 
 
 def unwrap_self(arg, **kwarg):
-    return PyTesseract.make_hocr_from_pnm(*arg, **kwarg)
+    # error() exits, which would kill the worker and leave pool.map waiting
+    try:
+        return PyTesseract.make_hocr_from_pnm(*arg, **kwarg)
+    except SystemExit:
+        raise RuntimeError("OCR of %s failed" % arg[1])
 
 
 class PyTesseract(object):
@@ -54,6 +85,12 @@ class PyTesseract(object):
         self.required = "3.02.02"
         self.threads = config.get('threads', 4)
 
+        # 'api' keeps an engine per worker process, 'cli' runs the binary per page
+        self.backend = config.get('backend', 'cli')
+        if self.backend == 'api' and tesserocr is None:
+            logging.warning("tesserocr is not installed, running the tesseract binary instead")
+            self.backend = 'cli'
+
         if "binary" in config:  # Override location of binary
             binary = config['binary']
             if os.name == 'nt':
@@ -134,7 +171,14 @@ class PyTesseract(object):
     def _warn(self, msg):  # pragma: no cover
         pass
 
-    def make_hocr_from_pnms(self, fns):
+    def make_hocr_from_pnms(self, fns, pool=None):
+        """
+            :param pool: Optional worker pool to run on, left running for the caller
+        """
+        if pool is not None:
+            hocr_filenames = pool.map(
+                unwrap_self, list(zip([self]*len(fns), fns)))
+            return list(zip(fns, hocr_filenames))
 
         # Glob it
         #fns = glob.glob(img_filename)
@@ -154,6 +198,83 @@ class PyTesseract(object):
 
         return list(zip(fns, hocr_filenames))
 
+    def _get_engine(self):
+        """
+            Engine of this process for self.lang, initialized on first use
+        """
+        if self.lang not in _engines:
+            logging.info("Initializing tesseract engine for %s" % self.lang)
+            engine = tesserocr.PyTessBaseAPI(lang=self.lang, psm=tesserocr.PSM.AUTO_OSD)
+            engine.SetVariable("hocr_font_info", "1")
+            _engines[self.lang] = engine
+        return _engines[self.lang]
+
+    def make_hocr_text(self, img):
+        """
+            Run the engine of this process on an image
+
+            :param img: Page image filename or PIL image
+            :returns: hOCR document of the page as a string
+        """
+        engine = self._get_engine()
+        if isinstance(img, str):
+            engine.SetImageFile(img)
+        else:
+            engine.SetImage(img)
+        page = engine.GetHOCRText(0)
+        return HOCR_HEADER % tesserocr.tesseract_version().split()[1] + page + HOCR_FOOTER
+
+    def make_hocr_from_image(self, image, img_filename):
+        """
+            Run the engine of this process on a page in memory, the image is only
+            written to img_filename if the binary has to be used instead
+
+            :param image: PIL image of the page
+            :param img_filename: Image filename the hocr file is named after, need not exist
+            :returns: hocr filename
+        """
+        if self.backend == 'api':
+            try:
+                hocr = self.make_hocr_text(image)
+            except RuntimeError as e:
+                logging.warning("Tesseract engine failed (%s), running the binary instead" % e)
+                self.backend = 'cli'
+            else:
+                hocr_filename = "%s.hocr" % os.path.splitext(img_filename)[0]
+                with open(hocr_filename, 'w', encoding='utf-8') as f:
+                    f.write(hocr)
+                return hocr_filename
+        return self.make_hocr_from_stdin(image, img_filename)
+
+    def make_hocr_from_stdin(self, image, img_filename):
+        """
+            Run the binary on a page piped to it as raw PNM, so no image file is written
+
+            :param image: PIL image of the page
+            :param img_filename: Image filename the hocr file is named after, need not exist
+            :returns: hocr filename
+        """
+        basename, filext = os.path.splitext(img_filename)
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('L')
+        data = io.BytesIO()
+        image.save(data, format='PPM')
+
+        logging.info("Running OCR on %s to create %s.hocr" %
+                     (img_filename, basename))
+        cmd = '%s stdin "%s" -psm 1 -c hocr_font_info=1 -l %s hocr' % (
+            self.binary, basename, self.lang)
+        logging.info(cmd)
+        try:
+            ret_output = subprocess.check_output(
+                cmd, shell=True, input=data.getvalue(), stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            # Could not run tesseract
+            print(e.output)
+            self._warn(self.msgs['TS_FAILED'])
+
+        return self._find_hocr(basename)
+
     def make_hocr_from_pnm(self, img_filename):
 
         basename, filext = os.path.splitext(img_filename)
@@ -162,6 +283,20 @@ class PyTesseract(object):
         if not os.path.exists(img_filename):
             error(self.msgs['TS_img_MISSING'] + " %s" % (img_filename))
 
+        if self.backend == 'api':
+            try:
+                hocr = self.make_hocr_text(img_filename)
+            except RuntimeError as e:
+                # Engine could not be initialized, e.g. missing language data
+                logging.warning("Tesseract engine failed (%s), running the binary instead" % e)
+                self.backend = 'cli'
+            else:
+                hocr_filename = "%s.hocr" % basename
+                with open(hocr_filename, 'w', encoding='utf-8') as f:
+                    f.write(hocr)
+                logging.info("Created %s.hocr" % basename)
+                return hocr_filename
+
         logging.info("Running OCR on %s to create %s.html" %
                      (img_filename, basename))
         cmd = '%s "%s" "%s" -psm 1 -c hocr_font_info=1 -l %s hocr' % (
@@ -175,6 +310,13 @@ class PyTesseract(object):
             print(e.output)
             self._warn(self.msgs['TS_FAILED'])
 
+        return self._find_hocr(basename)
+
+    def _find_hocr(self, basename):
+        """
+            Output file of the binary for an image, by tesseract version
+        """
+        hocr_filename = "%s.html" % basename
         if os.path.isfile(hocr_filename):
             # Output format is html for old versions of tesseract
             logging.info("Created %s.html" % basename)
@@ -0,0 +1,157 @@
+import os
+import pickle
+
+from collections import OrderedDict
+from functools import wraps
+
+# default number of entries kept by each cache
+DEFAULT_SIZE = 50000
+
+# caches are registered by name so that they can be persisted together
+CACHES = OrderedDict()
+
+
+class LRUCache:
+    '''
+    Size bounded mapping that evicts the least recently used entry
+    and counts hits and misses on lookups
+    '''
+
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    # return cached value and mark it as recently used
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    # store value and evict oldest entries beyond the size limit
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        while len(self.entries) > max(maxsize, 0):
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return "hits={} misses={} size={}/{}".format(
+            self.hits, self.misses, len(self.entries), self.maxsize)
+
+
+def get_cache(name):
+    if name not in CACHES:
+        CACHES[name] = LRUCache()
+    return CACHES[name]
+
+
+def memoize(name):
+    '''
+    Decorator caching results of a single argument function in the named cache
+    Cached values are shared between callers so they must not be mutated
+    '''
+    cache = get_cache(name)
+    missing = object()
+
+    def decorator(func):
+        @wraps(func)
+        def result(arg):
+            value = cache.get(arg, missing)
+            if value is missing:
+                value = func(arg)
+                cache.put(arg, value)
+            return value
+        result.cache = cache
+        return result
+    return decorator
+
+
+def configure(maxsize):
+    '''
+    Set size limit of all caches, a size of 0 disables caching
+    '''
+    for cache in CACHES.values():
+        cache.resize(maxsize)
+
+
+def load(path, tag=None):
+    '''
+    Warm up caches from a file written by save, missing file is ignored
+    Entries saved with a different tag, e.g. under another dictionary,
+    are dropped. Returns True if entries were loaded
+    '''
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        stored = pickle.load(f)
+    if stored.get("tag") != tag or "caches" not in stored:
+        return False
+    merge(stored["caches"])
+    return True
+
+
+def save(path, tag=None):
+    '''
+    Write entries of all caches to file in least to most recently used order
+    along with a tag naming what the entries were computed from
+    '''
+    stored = {"tag": tag, "caches": entries()}
+    with open(path, "wb") as f:
+        pickle.dump(stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def keys():
+    '''
+    Returns the keys of all caches by cache name, to pass to entries later
+    '''
+    return {name: set(cache.entries) for name, cache in CACHES.items()}
+
+
+def entries(known=None):
+    '''
+    Returns entries of all caches by cache name, least recently used first
+    Entries with keys in known, as returned by keys, are left out
+    '''
+    known = known or {}
+    return {name: [(key, value) for key, value in cache.entries.items()
+                   if key not in known.get(name, ())]
+            for name, cache in CACHES.items()}
+
+
+def merge(stored):
+    '''
+    Add entries returned by entries, e.g. by another process, to the caches
+    '''
+    for name, items in stored.items():
+        cache = get_cache(name)
+        for key, value in items:
+            cache.put(key, value)
+
+
+def stats():
+    return "\n".join("{}: {}".format(name, cache) for name, cache in CACHES.items())
@@ -1,20 +1,100 @@
+import os
 import re
 from collections import Counter
 
+import spell_cache
+import compiled_dictionary
+
 
 def words(text): return re.findall(r'\w+', text.lower())
 
 
-WORDS = Counter(words(open('dictionary.txt').read()))
+# dictionary shipped next to this file, can be changed with set_dictionary
+# a compiled copy built by compiled_dictionary.py is used when up to date
+DICTIONARY_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'dictionary.txt')
+
+# word counts are read lazily on first lookup by load
+WORDS = Counter()
+TOTAL = 0
 # for x in range(0, 10000000):
 #     WORDS[str(x)] = 1
 
+# maximum edit distance searched for a correction
+MAX_DISTANCE = 2
+
+
+def deletes(word, distance=MAX_DISTANCE):
+    "All strings made by deleting up to `distance` characters from `word`."
+    results = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = set(e[:i] + e[i+1:] for e in frontier for i in range(len(e)))
+        results |= frontier
+    return results
+
+
+def build_index(words, distance=MAX_DISTANCE):
+    "Map every delete of every word to the dictionary words it came from."
+    index = {}
+    for word in words:
+        for delete in deletes(word, distance):
+            index.setdefault(delete, []).append(word)
+    return index
+
+
+# symmetric delete index, a word within `MAX_DISTANCE` edits of a dictionary
+# word shares at least one delete with it
+DELETES = {}
+
+
+def load(path=None):
+    "Read word counts from the dictionary and build the delete index."
+    global WORDS, DELETES, TOTAL
+    path = path or DICTIONARY_PATH
+    if path.endswith('.bin'):
+        compiled = path
+    else:
+        compiled = compiled_dictionary.find_compiled(path)
+    if compiled:
+        dictionary = compiled_dictionary.open_compiled(compiled)
+        WORDS, DELETES, TOTAL = dictionary.words, dictionary.deletes, dictionary.total
+        return
+    with open(path) as f:
+        WORDS = Counter(words(f.read()))
+    DELETES = build_index(WORDS)
+    TOTAL = sum(WORDS.values())
+
+
+def set_dictionary(path):
+    "Use the dictionary at `path`, it is read on the next lookup."
+    global DICTIONARY_PATH, WORDS, DELETES, TOTAL
+    DICTIONARY_PATH = path
+    WORDS = Counter()
+    DELETES = {}
+    TOTAL = 0
+    spell_cache.get_cache("correction").clear()
+    spell_cache.get_cache("spelling_fixer").clear()
+
+
+def dictionary_digest():
+    "sha256 of the dictionary in use, names the results cached under it."
+    return compiled_dictionary.source_digest(DICTIONARY_PATH)
 
-def P(word, N=sum(WORDS.values())):
+
+def ensure_loaded():
+    "Load the dictionary if no lookup has needed it yet."
+    if not WORDS:
+        load()
+
+
+def P(word, N=None):
     "Probability of `word`."
-    return WORDS[word] / N
+    ensure_loaded()
+    return WORDS.get(word, 0) / (N or TOTAL)
 
 
+@spell_cache.memoize("correction")
 def correction(word):
     "Most probable spelling correction for word."
     if candidates(word):
@@ -25,19 +105,58 @@ def correction(word):
 
 def candidates(word):
     "Generate possible spelling corrections for word."
+    ensure_loaded()
     if word.isdigit():
         return [word]
     elif len(word) > 2:
-        return (known([word]) or known(edits1(word)) or known(edits2(word)) or [word])
+        return (known([word]) or known_within(word, 1) or known_within(word, 2) or [word])
     else:
         return(known([word]))
 
 
 def known(words):
     "The subset of `words` that appear in the dictionary of WORDS."
+    ensure_loaded()
     return set(w for w in words if w in WORDS)
 
 
+def known_within(word, distance):
+    "The dictionary words exactly `distance` edits away from `word`."
+    similar = set()
+    for delete in deletes(word, distance):
+        similar.update(DELETES.get(delete, ()))
+    return set(w for w in similar if edit_distance(word, w) == distance)
+
+
+def edit_distance(source, target):
+    '''
+    Damerau-Levenshtein distance between two strings, counting inserts,
+    deletes, replaces and transposes of adjacent characters. This is the
+    number of `edits1` steps needed to reach one string from the other.
+    '''
+    alphabet = {}
+    inf = len(source) + len(target)
+    table = [[inf] * (len(target) + 2)]
+    table += [[inf] + list(range(len(target) + 1))]
+    table += [[inf, i] + [0] * len(target) for i in range(1, len(source) + 1)]
+    for i in range(1, len(source) + 1):
+        last_match = 0
+        for j in range(1, len(target) + 1):
+            k = alphabet.get(target[j-1], 0)
+            l = last_match
+            if source[i-1] == target[j-1]:
+                cost = 0
+                last_match = j
+            else:
+                cost = 1
+            table[i+1][j+1] = min(table[i][j] + cost,
+                                  table[i+1][j] + 1,
+                                  table[i][j+1] + 1,
+                                  table[k][l] + (i - k - 1) + 1 + (j - l - 1))
+        alphabet[source[i-1]] = i
+    return table[len(source) + 1][len(target) + 1]
+
+
 def edits1(word):
     "All edits that are one edit away from `word`."
     letters = 'abcdefghijklmnopqrstuvwxyz1234567890'
@@ -1,23 +1,13 @@
-import os
+import bisect
+import json
 import wordsegment
-import re
 
-from text_objects import Line, Word, Rectangle, LineType
-import spell_correct
-
-# load data for word segementation
-wordsegment.load()
-
-term_index = 0
-count_index = 1
-prefix_length = 7
-max_ed_dictionary = 3
+from collections import Counter
 
-UNIMPORTANT_SINGLES = [
-    '.',
-    ',',
-    '('
-]
+import text_objects
+import spell_correct
+import spell_cache
+import compiled_dictionary
 
 PL_LINES = [
     # add corrections for words
@@ -44,7 +34,51 @@ FOOTERS = [
     ['PAGE']
 ]
 
+# pattern lists by their name in a patterns file
+PATTERN_SETS = {
+    'pl_lines': PL_LINES,
+    'header_endings': HEADER_ENDINGS,
+    'footers': FOOTERS,
+}
+
+# matchers of groups of pattern lists, compiled on first use
+MATCHERS = {}
+
+
+# word segmenter, created on first use
+SEGMENTER = None
+
+
+def get_segmenter():
+    '''
+    Returns the word segmenter, loading its data on the first call
+    Counts are taken from the compiled dictionary when it includes them
+    '''
+    global SEGMENTER
+    if SEGMENTER is None:
+        segmenter = wordsegment.Segmenter()
+        compiled = compiled_dictionary.find_compiled(spell_correct.DICTIONARY_PATH)
+        dictionary = compiled and compiled_dictionary.open_compiled(compiled)
+        if dictionary and dictionary.unigrams is not None:
+            segmenter.unigrams = dictionary.unigrams
+            segmenter.bigrams = dictionary.bigrams
+            segmenter.total = dictionary.meta['segment_total']
+            segmenter.limit = dictionary.meta['segment_limit']
+        else:
+            segmenter.load()
+        SEGMENTER = segmenter
+    return SEGMENTER
+
+
+@spell_cache.memoize("segment")
+def segment(word):
+    '''
+    Takes a string and returns a tuple of the words it splits into
+    '''
+    return tuple(get_segmenter().segment(word))
+
 
+@spell_cache.memoize("spelling_fixer")
 def spelling_fixer(word):
     '''
     Takes a string and returns its spell corrected value
@@ -60,7 +94,7 @@ def spelling_fixer(word):
             seg_words = [word]
         else:
             if not word.isdigit():
-                seg_words = wordsegment.segment(word)
+                seg_words = list(segment(word))
             else:
                 seg_words = [word]
             for seg_index in range(len(seg_words)):
@@ -98,35 +132,121 @@ def spelling_accept(word):
     return True
 
 
-def gen_filter(line, match_lines):
+class LineMatcher:
     '''
-    return True if line has a match with any of the match_lines to the profit and loss table
+    Named lists of patterns compiled to classify all lines of a page at once
+
+    A pattern is a list of words and matches a line when every word is part
+    of some word of the line, ignoring case. Pattern words are lowercased
+    once and each distinct word is searched for once in the text of a page
     '''
-    for match_line in match_lines:
-        status = True
-        for word in match_line:
-            flag = False
-            for words in line:
-                if word.lower() in words.value.lower():
-                    flag = True
 
-            if not flag:
-                status = False
-                break
+    def __init__(self, pattern_sets):
+        # patterns using each distinct word, and words needed by each pattern
+        self.owners = {}
+        self.sizes = {}
+        self.always = set()
+        for name, patterns in pattern_sets.items():
+            for number, pattern in enumerate(patterns):
+                words = set(word.lower() for word in pattern) - {''}
+                if not words:
+                    self.always.add(name)
+                    continue
+                self.sizes[name, number] = len(words)
+                for word in words:
+                    self.owners.setdefault(word, []).append((name, number))
 
-        if status:
-            return True
-    return False
+    def classify_lines(self, lines):
+        '''
+        Returns for each line the set of names of pattern lists matching it
+        '''
+        # words of all lines joined by a separator no pattern word contains
+        texts = ["\0".join(word.value for word in line).lower() for line in lines]
+        starts = []
+        position = 0
+        for text in texts:
+            starts.append(position)
+            position += len(text) + 1
+        page = "\0".join(texts)
+
+        found = [[] for _ in texts]
+        for word in self.owners:
+            index = page.find(word)
+            while index >= 0:
+                number = bisect.bisect_right(starts, index) - 1
+                found[number].append(word)
+                if number + 1 == len(starts):
+                    break
+                index = page.find(word, starts[number + 1])
+
+        classes = []
+        for words in found:
+            names = set(self.always)
+            if words:
+                counts = Counter(owner for word in words for owner in self.owners[word])
+                names.update(owner[0] for owner, count in counts.items()
+                             if count == self.sizes[owner])
+            classes.append(names)
+        return classes
+
+
+def get_matcher(names=None):
+    '''
+    Returns the matcher of the named pattern lists, all lists by default,
+    compiling it on the first call
+    '''
+    names = tuple(sorted(names or PATTERN_SETS))
+    if names not in MATCHERS:
+        MATCHERS[names] = LineMatcher({name: PATTERN_SETS[name] for name in names})
+    return MATCHERS[names]
+
+
+def classify_lines(lines, names=None):
+    '''
+    Returns for each line the set of names of pattern lists matching it,
+    only the named lists are tried if names are given
+    '''
+    return get_matcher(names).classify_lines(lines)
+
+
+def load_patterns(path):
+    '''
+    Replace pattern lists with the lists of a json file, e.g.
+    {"pl_lines": [["PROFIT", "LOSS", "ACCOUNT"]], "footers": [["PAGE"]]}
+    Lists missing from the file keep their defaults
+    '''
+    with open(path) as f:
+        pattern_sets = json.load(f)
+    if not isinstance(pattern_sets, dict):
+        raise ValueError("Patterns in {} must be an object of named lists".format(path))
+    for name, patterns in pattern_sets.items():
+        if name not in PATTERN_SETS:
+            raise ValueError("Unknown pattern list {} in {}, expected one of {}".format(
+                name, path, ", ".join(PATTERN_SETS)))
+        # every pattern is a list of words
+        if not isinstance(patterns, list) or not all(
+                isinstance(pattern, list) and all(isinstance(word, str) for word in pattern)
+                for pattern in patterns):
+            raise ValueError("Pattern list {} in {} must be a list of lists of strings".format(
+                name, path))
+    set_patterns(pattern_sets)
+
+
+def set_patterns(pattern_sets):
+    '''
+    Replace the named pattern lists with the given lists
+    '''
+    for name, patterns in pattern_sets.items():
+        # replace in place so lists imported elsewhere see the new patterns
+        PATTERN_SETS[name][:] = patterns
+    MATCHERS.clear()
 
 
 def p_l_filter(lines):
     '''
     return True if any of the lines is related to p and l
     '''
-    for line in lines:
-        if gen_filter(line, PL_LINES):
-            return True
-    return False
+    return any(classify_lines(lines, ['pl_lines']))
 
 
 def set_headers(lines):
@@ -140,20 +260,20 @@ def set_headers(lines):
         1 = possible header reached
     '''
     status = 0
-    for line in lines:
+    for line, names in zip(lines, classify_lines(lines, ['pl_lines', 'header_endings'])):
         if line.type == -1:
             continue
         if is_in_top_quarter(line):
-            if gen_filter(line, PL_LINES):
+            if 'pl_lines' in names:
                 status = 1
-                line.type = LineType.HEADER
-            elif gen_filter(line, HEADER_ENDINGS):
-                line.type = LineType.HEADER
+                line.type = text_objects.LineType.HEADER
+            elif 'header_endings' in names:
+                line.type = text_objects.LineType.HEADER
                 break
             elif status == 1:
                 break
             else:
-                line.type = LineType.HEADER
+                line.type = text_objects.LineType.HEADER
         else:
             break
 
@@ -168,18 +288,18 @@ def set_footers(lines):
         0 = footer continues
         1 = possible footer reached
     '''
-    lines.sort(reverse=True)
+    lines.sort(key=text_objects.vertical_key, reverse=True)
     status = 0
-    for line in lines:
+    for line, names in zip(lines, classify_lines(lines, ['footers'])):
         if line.type == -1:
             continue
         if is_in_lowest_quarter(line):
-            if gen_filter(line, FOOTERS):
+            if 'footers' in names:
                 status = 1
-                line.type = LineType.FOOTER
+                line.type = text_objects.LineType.FOOTER
             elif status == 1:
-                if gen_filter(line, FOOTERS):
-                    line.type = LineType.FOOTER
+                if 'footers' in names:
+                    line.type = text_objects.LineType.FOOTER
                 break
         else:
             break
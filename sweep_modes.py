@@ -0,0 +1,240 @@
+# Sweep a grid of parsing mode margins against expected csv files
+#
+# Words of every document are read once from the word files in words/ and
+# handed to every worker, then profit and loss rows are extracted under every
+# combination of margins and compared cell by cell with the expected csv of
+# the document.
+#
+# Usage: python3 sweep_modes.py -p DIR -e EXPECTED_DIR [--line-margin 5,10,15 ...]
+#
+# DIR is a directory converted by driver.py before, EXPECTED_DIR holds a
+# <name>.csv for every document to score
+
+import argparse
+import csv
+import itertools
+import os
+import time
+
+from multiprocessing import Pool, cpu_count
+from os.path import join
+
+import spell_correct
+import spell_fixer
+import word_cache
+from generate_csv import extract_rows
+from parsing_modes import parsing_modes
+from pypdfocr.pypdfocr_interrupts import init_worker
+from text_objects import Word
+
+# margins swept by default, the csv does not depend on para_margin
+DEFAULT_GRID = {
+    'line_margin': [5, 10, 15],
+    'merge_margin': [10, 15, 30],
+    'adj_margin': [10, 15, 20],
+    'large_cutoff': [0.6],
+    'column_margin': [10, 20, 30],
+}
+
+# documents of a worker process as (name, pages, expected rows)
+DOCUMENTS = []
+
+
+# keep the documents in a worker process, with the dictionary and patterns
+# the parent loaded and checked. Nothing here reads files or can fail, a
+# failing initializer would only make the pool start new workers forever
+def load_documents(documents, dictionary, pattern_sets):
+    global DOCUMENTS
+    init_worker()
+    DOCUMENTS = documents
+    # workers that are not forked start from the default dictionary
+    if spell_correct.DICTIONARY_PATH != dictionary:
+        spell_correct.set_dictionary(dictionary)
+    spell_fixer.set_patterns(pattern_sets)
+
+
+# read the dictionary and warm up spelling caches in the parent, so errors
+# show before workers start and forked workers do not spend the time of
+# the first modes filling them
+def warm_up(documents):
+    spell_correct.ensure_loaded()
+    for name, pages, expected in documents:
+        extract_rows(copy_pages(pages), parsing_modes['standard'])
+
+
+# extracting rows merges words in place, every mode gets its own copy
+def copy_pages(pages):
+    return [(page_box, [Word(word.value, word.box.copy()) for word in words])
+            for page_box, words in pages]
+
+
+def read_expected(csv_path):
+    with open(csv_path, newline='') as f:
+        return list(csv.reader(f))
+
+
+# count cells of expected and extracted rows that match by position
+# returns matched and total cells
+def score_rows(rows, expected):
+    rows = [['' if value is None else value for value in row] for row in rows or []]
+    matched = total = 0
+    for row, expected_row in itertools.zip_longest(rows, expected, fillvalue=[]):
+        for value, expected_value in itertools.zip_longest(row, expected_row):
+            total += 1
+            matched += value == expected_value
+    return matched, total
+
+
+# score one mode on all documents of the worker
+# returns label, mode, matched cells, total cells, exact documents and seconds
+def evaluate(task):
+    label, mode = task
+    matched = total = exact = 0
+    seconds = 0.0
+    for name, pages, expected in DOCUMENTS:
+        pages = copy_pages(pages)
+        start = time.perf_counter()
+        rows = extract_rows(pages, mode)
+        seconds += time.perf_counter() - start
+        doc_matched, doc_total = score_rows(rows, expected)
+        matched += doc_matched
+        total += doc_total
+        exact += doc_matched == doc_total
+    return label, mode, matched, total, exact, seconds
+
+
+# named modes of the driver followed by every combination of the grid
+def make_tasks(grid):
+    tasks = [(name, mode) for name, mode in parsing_modes.items()]
+    keys = list(grid)
+    for values in itertools.product(*(grid[key] for key in keys)):
+        mode = dict(parsing_modes['standard'])
+        mode.update(zip(keys, values))
+        tasks.append(("grid", mode))
+    return tasks
+
+
+# read words of documents in working_dir that have an expected csv file
+# returns (name, pages, expected rows) of every document
+def find_documents(working_dir, expected_dir, hocr=False):
+    documents = []
+    for file_name in sorted(os.listdir(expected_dir)):
+        name, ext = os.path.splitext(file_name)
+        if ext != ".csv":
+            continue
+        if hocr:
+            input_path = join(working_dir, "hocr", name)
+            kind = "hocr"
+        else:
+            input_path = join(working_dir, "xml", name + ".xml")
+            kind = "xml"
+        if not os.path.exists(input_path):
+            print("No readable file for {}, skipping".format(name))
+            continue
+        pages = list(word_cache.cached_words(input_path, word_cache.words_path(working_dir, name, kind)))
+        documents.append((name, pages, read_expected(join(expected_dir, file_name))))
+    return documents
+
+
+def sweep(documents, tasks, processes=None):
+    '''
+    evaluate tasks of (label, mode) on documents in parallel, with the
+    dictionary and patterns in use in this process
+    returns results of evaluate, best accuracy first
+    '''
+    warm_up(documents)
+    processes = processes or cpu_count()
+    pool = Pool(processes=processes, initializer=load_documents,
+                initargs=(documents, spell_correct.DICTIONARY_PATH, spell_fixer.PATTERN_SETS))
+    try:
+        results = list(pool.imap_unordered(
+            evaluate, tasks, chunksize=max(1, len(tasks) // (4 * processes))))
+        pool.close()
+    except KeyboardInterrupt:
+        print("Caught keyboard interrupt... terminating")
+        pool.terminate()
+        raise
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    results.sort(key=lambda x: (-x[2] / max(x[3], 1), x[5]))
+    return results
+
+
+def format_mode(mode):
+    return " ".join("{}={}".format(key, mode[key]) for key in sorted(mode))
+
+
+def write_report(results, output_path):
+    keys = sorted(parsing_modes['standard'])
+    with open(output_path, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["label"] + keys + ["accuracy", "exact", "ms"])
+        for label, mode, matched, total, exact, seconds in results:
+            writer.writerow([label] + [mode[key] for key in keys] +
+                            [matched / max(total, 1), exact, seconds * 1000])
+
+
+# comma separated values of one grid parameter
+def grid_values(text):
+    return [float(value) if "." in value else int(value) for value in text.split(",")]
+
+
+def make_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Score a grid of parsing modes against expected csv files")
+    parser.add_argument("-p", "--path", help="directory converted by driver.py before",
+                        required=True)
+    parser.add_argument("-e", "--expected", help="directory of expected <name>.csv files",
+                        required=True)
+    parser.add_argument("--hocr", help="read words from hocr/ instead of xml/",
+                        action="store_true")
+    parser.add_argument("--dictionary", help="word list used for spelling correction, default is dictionary.txt",
+                        required=False, default=None)
+    parser.add_argument("--patterns", help="json file of the patterns that find profit and loss headers and footers",
+                        required=False, default=None)
+    parser.add_argument("-j", "--jobs", help="number of worker processes, default is all cores",
+                        type=int, default=None)
+    parser.add_argument("-n", "--top", help="number of modes to print, default is 10",
+                        type=int, default=10)
+    parser.add_argument("-o", "--output", help="csv file to write the scores of all modes to",
+                        required=False, default=None)
+    for key, values in DEFAULT_GRID.items():
+        parser.add_argument("--" + key.replace("_", "-"), type=grid_values,
+                            default=values, metavar="VALUES",
+                            help="comma separated values of {}, default is {}".format(
+                                key, ",".join(map(str, values))))
+    return parser
+
+
+if __name__ == "__main__":
+    args = make_argument_parser().parse_args()
+    if args.dictionary:
+        spell_correct.set_dictionary(args.dictionary)
+    if args.patterns:
+        spell_fixer.load_patterns(args.patterns)
+    documents = find_documents(args.path, args.expected, args.hocr)
+    if not documents:
+        print("No documents with expected csv files found")
+        raise SystemExit(1)
+
+    grid = {key: getattr(args, key) for key in DEFAULT_GRID}
+    tasks = make_tasks(grid)
+    print("Scoring {} modes on {} documents".format(len(tasks), len(documents)))
+    start = time.perf_counter()
+    results = sweep(documents, tasks, args.jobs)
+    print("Swept in {:.1f} s".format(time.perf_counter() - start))
+
+    for label, mode, matched, total, exact, seconds in results[:args.top]:
+        print("{:>12} {:>7.2%} {:>3}/{} exact {:>9.2f} ms  {}".format(
+            label, matched / max(total, 1), exact, len(documents), seconds * 1000, format_mode(mode)))
+    for label, mode, matched, total, exact, seconds in results:
+        if label != "grid":
+            print("{:>12} {:>7.2%} {:>3}/{} exact {:>9.2f} ms".format(
+                label, matched / max(total, 1), exact, len(documents), seconds * 1000))
+
+    if args.output:
+        write_report(results, args.output)
+        print("Wrote scores to {}".format(args.output))
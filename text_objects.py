@@ -1,6 +1,15 @@
+import bisect
+import glob
+import os
+import re
+import xml.etree.ElementTree as tree
+
+from collections import deque
 from enum import Enum
+from operator import attrgetter
 
 import spell_fixer
+import word_cache
 
 
 class LineType(Enum):
@@ -11,7 +20,15 @@ class LineType(Enum):
     FOOTER = 5
 
 
+# sort keys for layout objects with a bounding box
+# prefer these over the comparison operators when sorting large lists
+vertical_key = attrgetter("box.y1")
+horizontal_key = attrgetter("box.x1")
+
+
 class Rectangle:
+    __slots__ = ("x1", "y1", "x2", "y2")
+
     def __init__(self, values):
         self.x1 = values[0]
         self.y1 = values[1]
@@ -19,12 +36,15 @@ class Rectangle:
         self.y2 = values[3]
 
     def copy(self):
-        return Rectangle([self.x1, self.y1, self.x2, self.y2])
+        return Rectangle((self.x1, self.y1, self.x2, self.y2))
 
     # sort in vertically
     def __gt__(self, value):
         return self.y1 > value.y1
 
+    def __lt__(self, value):
+        return self.y1 < value.y1
+
     # merge two rectangles to get largest possible rectangles
     def merge(self, value):
         self.x1 = min(self.x1, value.x1)
@@ -37,6 +57,7 @@ class Rectangle:
 
 
 class Word:
+    __slots__ = ("value", "box", "row_num", "col_num")
 
     def __init__(self, value, box):
         self.value = value
@@ -51,6 +72,9 @@ class Word:
     def __gt__(self, value):
         return self.box.x1 > value.box.x1
 
+    def __lt__(self, value):
+        return self.box.x1 < value.box.x1
+
     # concatenate text and merge box
     def merge(self, other):
         self.value += " " + other.value
@@ -58,6 +82,7 @@ class Word:
 
 
 class Line:
+    __slots__ = ("box", "words", "row_num", "type")
 
     def __init__(self, word=None):
         if not word:
@@ -94,12 +119,16 @@ class Line:
     def __gt__(self, value):
         return self.box.y1 > value.box.y1
 
+    def __lt__(self, value):
+        return self.box.y1 < value.box.y1
+
     # debugging convenience will affect performance
     def __str__(self):
         return " ".join([word.__str__() for word in self.words])
 
 
 class Column:
+    __slots__ = ("words", "box", "col_num")
 
     def __init__(self, word):
         self.words = [word]
@@ -126,12 +155,16 @@ class Column:
     def __gt__(self, value):
         return self.box.x1 > value.box.x1
 
+    def __lt__(self, value):
+        return self.box.x1 < value.box.x1
+
     # debugging convenience will affect performance
     def __str__(self):
         return "\n".join([word.__str__() for word in self.words])
 
 
 class Paragraph:
+    __slots__ = ("lines", "box")
 
     def __init__(self, line):
         self.lines = [line]
@@ -152,39 +185,123 @@ class Paragraph:
 
     # sort vertically
     def __gt__(self, value):
-        return self.box.y1 > value.box.x1
+        return self.box.y1 > value.box.y1
 
+    def __lt__(self, value):
+        return self.box.y1 < value.box.y1
 
-# group words that are horizontally in the same line
-def get_lines(page_element, margin=5):
-    lines = []
-    page_box = Rectangle(
-        list(map(float, page_element.attrib["bbox"].split(","))))
-    for text_box in page_element.getchildren():
+
+# read textlines of a pdfminer page element as words
+def get_words(page_element):
+    words = []
+    for text_box in page_element:
         if not text_box.tag == "textbox":
             continue
-        for text_line in text_box.getchildren():
+        for text_line in text_box:
             if not text_line.tag == "textline":
                 continue
             bbox = Rectangle(
                 list(map(float, text_line.attrib["bbox"].split(","))))
             value = ''.join(
-                [text_char.text if text_char.text else " " for text_char in text_line.getchildren()])
-            value = value.strip()
-            if value[0] == '(' or value[-1] == ')':
-                value.rstrip(')')
-                value.lstrip('(')
-                value = "-" + value
-            word = Word(value, bbox)
-            added = False
-            for line in lines:
-                # check within a margin of error if the text_line can be added in an exisiting line
-                if (line.box.y1 - margin < bbox.y1 < line.box.y1 + margin) and (line.box.y2 - margin < bbox.y2 < line.box.y2 + margin):
-                    line.add_word(word)
-                    added = True
-
-            if not added:
-                lines.append(Line(word))
+                [text_char.text if text_char.text else " " for text_char in text_line])
+            words.append(Word(clean_value(value), bbox))
+    return words
+
+
+# strip text and mark values in brackets as negative
+def clean_value(value):
+    value = value.strip()
+    if value[0] == '(' or value[-1] == ')':
+        value.rstrip(')')
+        value.lstrip('(')
+        value = "-" + value
+    return value
+
+
+# stream pages of a pdfminer xml file as page box and words
+# each page is cleared once read so memory is bounded by the largest page
+def iter_pages(input_path):
+    context = tree.iterparse(input_path, events=("start", "end"))
+    _, root = next(context)
+    for event, element in context:
+        if event != "end" or element.tag != "page":
+            continue
+        page_box = Rectangle(
+            list(map(float, element.attrib["bbox"].split(","))))
+        words = get_words(element)
+        # drop the characters of the page and the page itself from the tree
+        element.clear()
+        root.clear()
+        yield page_box, words
+
+
+# hocr properties are stored in the title attribute
+HOCR_BBOX = re.compile(r"bbox\s+(-?\d+)\s+(-?\d+)\s+(-?\d+)\s+(-?\d+)")
+HOCR_SCAN_RES = re.compile(r"scan_res\s+(\d+)\s+(\d+)")
+
+
+# read ocrx_word elements of a hocr ocr_page element as words
+# pixel boxes measured from the top are converted to points from the bottom
+def get_hocr_words(page_element, dpi=300):
+    scan_res = HOCR_SCAN_RES.search(page_element.attrib.get("title", ""))
+    if scan_res:
+        dpi = int(scan_res.group(1))
+    scale = 72.0 / dpi
+    x1, y1, x2, y2 = map(int, HOCR_BBOX.search(
+        page_element.attrib["title"]).groups())
+    height = (y2 - y1) * scale
+    page_box = Rectangle((0.0, 0.0, (x2 - x1) * scale, height))
+
+    words = []
+    for element in page_element.iter():
+        if element.attrib.get("class") != "ocrx_word":
+            continue
+        value = "".join(element.itertext()).strip()
+        bbox = HOCR_BBOX.search(element.attrib.get("title", ""))
+        if not value or not bbox:
+            continue
+        x1, y1, x2, y2 = map(int, bbox.groups())
+        words.append(Word(clean_value(value), Rectangle(
+            (x1 * scale, height - y2 * scale, x2 * scale, height - y1 * scale))))
+    return page_box, words
+
+
+# pages of hocr files as page box and words
+def iter_hocr_pages(hocr_paths, dpi=300):
+    for hocr_path in hocr_paths:
+        for element in tree.parse(hocr_path).getroot().iter():
+            if element.attrib.get("class") == "ocr_page":
+                yield get_hocr_words(element, dpi)
+
+
+# pages of a pdfminer xml file, a directory of hocr files or a word file
+# hocr files are read in order of their names, one or more pages each
+def read_pages(input_path):
+    if input_path.endswith(".words"):
+        return word_cache.iter_words(input_path)
+    if os.path.isdir(input_path):
+        return iter_hocr_pages(sorted(glob.glob(os.path.join(input_path, "*.hocr"))))
+    return iter_pages(input_path)
+
+
+# sweep words from bottom to top and add each word to the first line
+# whose bottom and top edges are within margin of the word's edges
+def group_lines(words, margin=5):
+    lines = []
+    # lines that started less than margin below the current word
+    active = deque()
+    for word in sorted(words, key=lambda x: (x.box.y1, x.box.y2, x.box.x1)):
+        bbox = word.box
+        while active and active[0].box.y1 <= bbox.y1 - margin:
+            active.popleft()
+        for line in active:
+            if line.box.y2 - margin < bbox.y2 < line.box.y2 + margin:
+                line.add_word(word)
+                break
+        else:
+            line = Line(word)
+            lines.append(line)
+            active.append(line)
 
     return lines
 
@@ -210,20 +327,63 @@ def check_fix_spellings(lines, types):
     return new_lines
 
 
+# sorted column boundaries for finding the column a word belongs to
+class ColumnIndex:
+
+    def __init__(self, margin=20):
+        self.margin = margin
+        self.columns = []
+        # (x, position in columns) pairs sorted by left and right edges
+        self.starts = []
+        self.ends = []
+
+    def add(self, column):
+        bisect.insort(self.starts, (column.box.x1, len(self.columns)))
+        bisect.insort(self.ends, (column.box.x2, len(self.columns)))
+        self.columns.append(column)
+
+    # column whose edge in boundaries is nearest to value within margin
+    def _nearest(self, boundaries, value):
+        i = bisect.bisect_left(boundaries, (value, -1))
+        nearby = [entry for entry in boundaries[max(i - 1, 0):i + 1]
+                  if abs(entry[0] - value) < self.margin]
+        if not nearby:
+            return None
+        return self.columns[min(nearby, key=lambda x: (abs(x[0] - value), x[1]))[1]]
+
+    # column that starts more than margin left of box and ends right of it
+    def _containing(self, box):
+        i = bisect.bisect_left(self.starts, (box.x1 - self.margin, -1))
+        for x1, position in reversed(self.starts[:i]):
+            if box.x2 < self.columns[position].box.x2:
+                return self.columns[position]
+        return None
+
+    # prefer aligned left edges, then aligned right edges, then containment
+    def find(self, box):
+        return self._nearest(self.starts, box.x1) \
+            or self._nearest(self.ends, box.x2) \
+            or self._containing(box)
+
+
 # take lines of words and create columns from them
+# columns are returned from left to right with col_num set on them and their words
 def get_columns(lines, margin=20):
-    columns = []
+    index = ColumnIndex(margin)
     for line in lines:
         for word in line:
-            added = False
-            for column in columns:
-                if column.box.x1 - margin < word.box.x1 < column.box.x1 + margin \
-                        or column.box.x2 - margin < word.box.x2 < column.box.x2 + margin \
-                        or column.box.x1 + margin < word.box.x1 and word.box.x2 < column.box.x2:
-                    column.words.append(word)
-                    added = True
-            if not added:
-                columns.append(Column(word))
+            column = index.find(word.box)
+            if column:
+                column.words.append(word)
+            else:
+                index.add(Column(word))
+
+    columns = index.columns
+    columns.sort(key=horizontal_key)
+    for i, column in enumerate(columns):
+        column.col_num = i
+        for word in column.words:
+            word.col_num = i
     return columns
 
 
@@ -247,7 +407,7 @@ def get_paragraphs(lines, margin=20):
 def merge_words(lines, margin=15):
     new_lines = []
     for i, line in enumerate(lines):
-        line.words.sort()
+        line.words.sort(key=horizontal_key)
         merger = line.words[0]
         new_line = Line()
         for i, word in enumerate(line.words[1:]):
@@ -0,0 +1,120 @@
+# Cache of the words and boxes read from the readable file of a document
+#
+# Reading pdfminer xml or hocr is most of the time layout analysis takes, and
+# it does not depend on the parsing mode. Words of each document are written
+# once to a compact file in words/ next to xml/ and read back from there while
+# the readable file they were made from is unchanged. Words of the xml and of
+# the hocr of a document are kept in separate files.
+#
+# Layout of the file, in the section format of compiled_dictionary:
+#   values.blob, values.offsets: utf-8 word values back to back
+#   boxes: x1, y1, x2, y2 of every word as float64
+#   pages: x1, y1, x2, y2 of every page as float64
+#   page_starts: index of the first word of every page, and the word count
+# The sha256 of the readable file is kept in the header
+
+import glob
+import hashlib
+import os
+
+from array import array
+
+import text_objects
+from compiled_dictionary import CompiledFile, Writer
+
+MAGIC = b'BYOBWRDS'
+VERSION = 1
+
+
+# sha256 of a pdfminer xml file or of the hocr files of a directory
+def source_digest(input_path):
+    h = hashlib.sha256()
+    if os.path.isdir(input_path):
+        paths = sorted(glob.glob(os.path.join(input_path, "*.hocr")))
+    else:
+        paths = [input_path]
+    for path in paths:
+        h.update(os.path.basename(path).encode('utf-8') + b'\0')
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+def write_words(pages, output_path, digest):
+    '''
+    Write (page box, words) pairs to a word file
+    '''
+    blob = []
+    offsets = array('I', [0])
+    boxes = array('d')
+    page_boxes = array('d')
+    page_starts = array('I', [0])
+    for page_box, words in pages:
+        page_boxes.extend((page_box.x1, page_box.y1, page_box.x2, page_box.y2))
+        for word in words:
+            encoded = word.value.encode('utf-8')
+            blob.append(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+            boxes.extend((word.box.x1, word.box.y1, word.box.x2, word.box.y2))
+        page_starts.append(len(offsets) - 1)
+
+    writer = Writer(MAGIC, VERSION)
+    writer.meta['source'] = digest
+    writer.sections['values.blob'] = ('B', b''.join(blob))
+    writer.sections['values.offsets'] = ('I', offsets)
+    writer.sections['boxes'] = ('d', boxes)
+    writer.sections['pages'] = ('d', page_boxes)
+    writer.sections['page_starts'] = ('I', page_starts)
+
+    # write to a temporary file so an interrupted run leaves no partial file
+    tmp_path = output_path + '.tmp'
+    writer.write(tmp_path)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+# stream pages of a word file as page box and words
+def iter_words(path):
+    words_file = CompiledFile(path, MAGIC, VERSION)
+    blob = bytes(words_file.section('values.blob'))
+    offsets = words_file.section('values.offsets').tolist()
+    boxes = words_file.section('boxes').tolist()
+    page_boxes = words_file.section('pages').tolist()
+    page_starts = words_file.section('page_starts').tolist()
+    Rectangle, Word = text_objects.Rectangle, text_objects.Word
+    for page, (start, end) in enumerate(zip(page_starts, page_starts[1:])):
+        words = [Word(blob[offsets[i]:offsets[i + 1]].decode('utf-8'), Rectangle(boxes[4*i:4*i + 4]))
+                 for i in range(start, end)]
+        yield Rectangle(page_boxes[4*page:4*page + 4]), words
+
+
+# digest of the readable file a word file was made from, None if unreadable
+def cached_source(path):
+    try:
+        return CompiledFile(path, MAGIC, VERSION).meta['source']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+# word file of a document in working_dir, kind is "xml" or "hocr"
+def words_path(working_dir, name, kind):
+    return os.path.join(working_dir, "words", "{}.{}.words".format(name, kind))
+
+
+def cached_words(input_path, output_path):
+    '''
+    Returns pages of a pdfminer xml file or hocr directory as page box and
+    words, read from the word file at output_path. The input is parsed and
+    the word file written first if it is missing or was made from a
+    different input
+    '''
+    digest = source_digest(input_path)
+    if cached_source(output_path) == digest:
+        return iter_words(output_path)
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    pages = list(text_objects.read_pages(input_path))
+    write_words(pages, output_path, digest)
+    return pages